@@ -0,0 +1,236 @@
+"""
+VisualNovelAIAssistant 离线性能测试
+
+在子进程中启动模拟 LLM(SSE) 和 TTS 服务，按场景运行若干轮对话，
+统计首个回复包延迟、每轮总耗时、句子吞吐量、CPU 时间和内存，
+结果以 JSON 保存，可与之前的结果对比以发现性能回退。
+
+    python benchmarks/bench_assistant.py
+    python benchmarks/bench_assistant.py --scenario long --turns 20 --output new.json --compare old.json
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from queue import Queue
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "game", "python-packages"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import mock_servers  # noqa: E402
+
+# 场景：LLM 和 TTS 模拟服务的参数
+SCENARIOS = {
+    "baseline": {
+        "llm": {"sentences": 4, "token_rate": 200, "chunk_chars": 4, "first_token_ms": 200},
+        "tts": {"latency_ms": 300},
+    },
+    "long": {
+        "llm": {"sentences": 12, "token_rate": 200, "chunk_chars": 4, "first_token_ms": 200},
+        "tts": {"latency_ms": 300},
+    },
+    "split_tags": {
+        "llm": {"sentences": 6, "token_rate": 400, "chunk_chars": 3, "split_tags": True, "first_token_ms": 100},
+        "tts": {"latency_ms": 200},
+    },
+    "slow_tts": {
+        "llm": {"sentences": 6, "token_rate": 400, "chunk_chars": 8, "first_token_ms": 100},
+        "tts": {"latency_ms": 800, "audio_seconds": 4.0},
+    },
+    "flaky": {
+        "llm": {"sentences": 4, "token_rate": 200, "chunk_chars": 4, "first_token_ms": 200, "fail_rate": 0.3},
+        "tts": {"latency_ms": 300},
+    },
+}
+
+# 与基准对比时检查的指标，数值越大越差
+COMPARED_METRICS = ("first_reply_ms.p50", "first_reply_ms.p95", "turn_ms.p50", "turn_ms.p95", "cpu_s_per_turn")
+
+
+def describe(values):
+    ordered = sorted(values)
+    if not ordered:
+        return {}
+
+    def percentile(p):
+        return round(ordered[min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))], 1)
+
+    return {"mean": round(sum(ordered) / len(ordered), 1), "p50": percentile(50),
+            "p95": percentile(95), "p99": percentile(99)}
+
+
+def start_servers(scenario):
+    """在子进程中启动模拟服务，避免其 CPU 开销计入被测进程"""
+    ready = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=mock_servers.run_forever,
+        args=(scenario["llm"], scenario["tts"], 0, 0, ready),
+        daemon=True,
+    )
+    process.start()
+    llm_port, tts_port = ready.get(timeout=10)
+    return process, llm_port, tts_port
+
+
+def run_scenario(name, scenario, args):
+    from VisualNovelAIAssistant import VisualNovelAIAssistant
+
+    process, llm_port, tts_port = start_servers(scenario)
+    workdir = tempfile.mkdtemp(prefix="vnai-bench-")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+
+    reply_queue = Queue()
+    try:
+        assistant = VisualNovelAIAssistant(
+            api_key="bench",
+            reply_queue=reply_queue,
+            api_url=f"http://127.0.0.1:{llm_port}/chat/completions",
+            model="mock",
+            base_prompt="你是牧濑红莉栖",
+            tts_workers=args.tts_workers,
+            engine=args.engine,
+        )
+        assistant.tts_api_url = f"http://127.0.0.1:{tts_port}/synthesize"
+        assistant.use_tts = True
+        assistant.tts_streaming = args.streaming_tts
+        assistant.tts_binary = args.binary_tts
+        if not args.cache:
+            assistant.audio_cache = None
+
+        first_reply = []
+        turn_times = []
+        sentences = 0
+
+        tracemalloc.start()
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+
+        for turn in range(args.turns):
+            start = time.perf_counter()
+            assistant.start_fetching(f"第{turn}轮测试输入")
+            first = None
+            while True:
+                package = reply_queue.get(timeout=60)
+                if first is None:
+                    first = time.perf_counter() - start
+                if not (package and package["jp"] and package["cn"]):
+                    break
+                sentences += 1
+            first_reply.append(first * 1000)
+            turn_times.append((time.perf_counter() - start) * 1000)
+
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        stages = assistant.get_stats()["latency"]
+        assistant.close()
+    finally:
+        os.chdir(cwd)
+        process.terminate()
+
+    return {
+        "config": scenario,
+        "turns": args.turns,
+        "first_reply_ms": describe(first_reply),
+        "turn_ms": describe(turn_times),
+        "sentences_per_s": round(sentences / wall, 2) if wall else 0.0,
+        "cpu_s": round(cpu, 3),
+        "cpu_s_per_turn": round(cpu / args.turns, 4),
+        "py_peak_mb": round(peak / 1024 / 1024, 2),
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1) if resource else None,
+        "stages_ms": stages,
+    }
+
+
+def lookup(result, path):
+    value = result
+    for key in path.split("."):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def compare(current, baseline, threshold):
+    """
+    打印与基准结果的对比
+    :return: 是否存在超过阈值的回退
+    """
+    regressed = False
+    print(f"\n{'scenario':<12} {'metric':<22} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, result in current["scenarios"].items():
+        old = baseline.get("scenarios", {}).get(name)
+        if old is None:
+            continue
+        for metric in COMPARED_METRICS:
+            before, after = lookup(old, metric), lookup(result, metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            flag = " !" if change > threshold else ""
+            regressed |= change > threshold
+            print(f"{name:<12} {metric:<22} {before:>10} {after:>10} {change:>+7.1%}{flag}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="VisualNovelAIAssistant 离线性能测试")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="要运行的场景，可重复指定，默认运行全部")
+    parser.add_argument("--turns", type=int, default=10)
+    parser.add_argument("--tts-workers", type=int, default=4)
+    parser.add_argument("--engine", choices=("threads", "asyncio"), default="threads")
+    parser.add_argument("--streaming-tts", action="store_true")
+    parser.add_argument("--binary-tts", action="store_true")
+    parser.add_argument("--cache", action="store_true", help="启用 TTS 音频缓存")
+    parser.add_argument("--output", help="结果输出路径，默认 benchmarks/results/<时间>.json")
+    parser.add_argument("--compare", help="与之前的结果文件对比")
+    parser.add_argument("--threshold", type=float, default=0.10, help="判定为回退的相对变化")
+    args = parser.parse_args()
+
+    results = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "options": {"turns": args.turns, "tts_workers": args.tts_workers, "engine": args.engine,
+                    "streaming_tts": args.streaming_tts, "binary_tts": args.binary_tts, "cache": args.cache},
+        "scenarios": {},
+    }
+
+    for name in args.scenario or list(SCENARIOS):
+        result = run_scenario(name, SCENARIOS[name], args)
+        results["scenarios"][name] = result
+        print(f"{name:<12} first_reply p50={result['first_reply_ms'].get('p50')}ms "
+              f"turn p50={result['turn_ms'].get('p50')}ms sentences/s={result['sentences_per_s']} "
+              f"cpu={result['cpu_s']}s peak={result['py_peak_mb']}MB")
+
+    output = args.output or os.path.join(ROOT, "benchmarks", "results", time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"Results saved to {output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
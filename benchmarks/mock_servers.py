@@ -0,0 +1,242 @@
+"""
+本地模拟服务：OpenAI 风格的 SSE 流式 LLM 接口和 /synthesize TTS 接口
+
+可单独运行以便手动调试：
+    python benchmarks/mock_servers.py --llm-port 8001 --tts-port 8000
+"""
+import argparse
+import base64
+import io
+import json
+import random
+import threading
+import time
+import wave
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+JP_SENTENCES = [
+    "おかしいな、何をしているの？",
+    "私は牧瀬紅莉栖だよ。",
+    "科学的に説明すると、とても簡単なことなの。",
+    "あなたに理解できるかどうかは別の話だけどね。",
+    "まあ、少しは手伝ってあげてもいいわ。",
+    "勘違いしないで、これは実験のためよ。",
+]
+CN_SENTENCES = [
+    "真奇怪，你在做什么？",
+    "我是牧濑红莉栖啊。",
+    "用科学来解释的话，这是非常简单的事情。",
+    "不过你能不能理解就是另一回事了。",
+    "算了，稍微帮你一下也可以。",
+    "别误会，这是为了实验。",
+]
+
+
+def build_reply(sentences, rng):
+    """生成指定句数的 <jp>/<cn> 交替回复"""
+    parts = []
+    for _ in range(sentences):
+        index = rng.randrange(len(JP_SENTENCES))
+        parts.append(f"<jp>{JP_SENTENCES[index]}</jp>\n<cn>{CN_SENTENCES[index]}</cn>\n")
+    return "".join(parts)
+
+
+def split_reply(reply, chunk_chars, split_tags, rng):
+    """
+    将回复切分为流式数据块
+    :param chunk_chars: 每块的平均字符数
+    :param split_tags: 为 True 时随机切分，使标签跨数据块
+    """
+    chunks = []
+    position = 0
+    while position < len(reply):
+        size = rng.randint(1, chunk_chars * 2) if split_tags else chunk_chars
+        chunks.append(reply[position:position + size])
+        position += size
+    return chunks
+
+
+def silent_wav(seconds, rate=22050):
+    """生成指定时长的静音 WAV"""
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(b"\0\0" * int(rate * seconds))
+    return buffer.getvalue()
+
+
+class _QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # 客户端提前断开(例如取消请求)属于正常情况
+        pass
+
+
+def make_llm_handler(config):
+    """
+    :param config: sentences, token_rate(字符/秒), chunk_chars, split_tags, first_token_ms, seed,
+                   fail_rate(返回 503 的概率)
+    """
+    rng = random.Random(config.get("seed", 0))
+    lock = threading.Lock()
+
+    class LLMHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_HEAD(self):
+            self.send_response(200)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        do_GET = do_HEAD
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            with lock:
+                failed = rng.random() < config.get("fail_rate", 0.0)
+                reply = build_reply(config.get("sentences", 4), rng)
+                chunks = split_reply(reply, config.get("chunk_chars", 4), config.get("split_tags", False), rng)
+
+            if failed:
+                self._send_json({"error": {"message": "Service Unavailable"}}, status=503)
+                return
+
+            if not body.get("stream"):
+                # 非流式请求(总结)
+                time.sleep(config.get("first_token_ms", 200) / 1000)
+                self._send_json({"choices": [{"message": {"role": "assistant", "content": "总结:" + reply[:40]}}]})
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+            time.sleep(config.get("first_token_ms", 200) / 1000)
+            interval = config.get("chunk_chars", 4) / max(config.get("token_rate", 200), 1)
+            for chunk in chunks:
+                event = {"choices": [{"index": 0, "delta": {"content": chunk}}]}
+                self._write_chunk(b"data: " + json.dumps(event, ensure_ascii=False).encode("utf-8") + b"\n\n")
+                time.sleep(interval)
+
+            prompt_tokens = len(json.dumps(body.get("messages", []), ensure_ascii=False))
+            usage = {"prompt_tokens": prompt_tokens, "prompt_cache_hit_tokens": 0,
+                     "prompt_cache_miss_tokens": prompt_tokens, "completion_tokens": len(reply)}
+            self._write_chunk(b"data: " + json.dumps({"choices": [], "usage": usage}).encode("utf-8") + b"\n\n")
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._write_chunk(b"")
+
+        def _write_chunk(self, data):
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+        def _send_json(self, data, status=200):
+            payload = json.dumps(data, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+    return LLMHandler
+
+
+def make_tts_handler(config):
+    """
+    :param config: latency_ms, audio_seconds
+    """
+    audio = silent_wav(config.get("audio_seconds", 2.0))
+
+    class TTSHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_HEAD(self):
+            self.send_response(200)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        do_GET = do_HEAD
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            latency = config.get("latency_ms", 300) / 1000
+            wants_audio = "audio/" in self.headers.get("Accept", "")
+
+            if body.get("stream") and wants_audio:
+                # 流式输出：延迟均匀分布在各个数据块之间
+                self.send_response(200)
+                self.send_header("Content-Type", "audio/wav")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                pieces = [audio[i:i + 8192] for i in range(0, len(audio), 8192)]
+                for piece in pieces:
+                    time.sleep(latency / len(pieces))
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(piece), piece))
+                    self.wfile.flush()
+                self.wfile.write(b"0\r\n\r\n")
+                return
+
+            time.sleep(latency)
+            if wants_audio:
+                payload, content_type = audio, "audio/wav"
+            else:
+                payload = json.dumps({"audio": base64.b64encode(audio).decode("ascii")}).encode("utf-8")
+                content_type = "application/json"
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+    return TTSHandler
+
+
+def serve(llm_config, tts_config, llm_port=0, tts_port=0):
+    """
+    在后台线程中启动两个模拟服务
+    :return: (llm_server, tts_server)
+    """
+    servers = []
+    for handler, port in ((make_llm_handler(llm_config), llm_port), (make_tts_handler(tts_config), tts_port)):
+        server = _QuietServer(("127.0.0.1", port), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+    return tuple(servers)
+
+
+def run_forever(llm_config, tts_config, llm_port, tts_port, ready=None):
+    """在子进程中运行模拟服务，通过 ready 返回实际端口"""
+    llm_server, tts_server = serve(llm_config, tts_config, llm_port, tts_port)
+    if ready is not None:
+        ready.put((llm_server.server_port, tts_server.server_port))
+    threading.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本地模拟 LLM/TTS 服务")
+    parser.add_argument("--llm-port", type=int, default=8001)
+    parser.add_argument("--tts-port", type=int, default=8000)
+    parser.add_argument("--sentences", type=int, default=4)
+    parser.add_argument("--token-rate", type=float, default=200)
+    parser.add_argument("--chunk-chars", type=int, default=4)
+    parser.add_argument("--split-tags", action="store_true")
+    parser.add_argument("--tts-latency-ms", type=float, default=300)
+    args = parser.parse_args()
+
+    print(f"LLM: http://127.0.0.1:{args.llm_port}/chat/completions")
+    print(f"TTS: http://127.0.0.1:{args.tts_port}/synthesize")
+    run_forever(
+        {"sentences": args.sentences, "token_rate": args.token_rate,
+         "chunk_chars": args.chunk_chars, "split_tags": args.split_tags},
+        {"latency_ms": args.tts_latency_ms},
+        args.llm_port, args.tts_port,
+    )
@@ -12,21 +12,47 @@ import base64
 import io
 import os
 import asyncio
-from queue import Queue
-from itertools import zip_longest
-
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    filename="VisualNovelAIAssistant.log",
-    filemode="w",
-    encoding="utf-8"
-)
+from queue import Empty, Full, Queue
+from itertools import count, zip_longest
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from .async_engine import AsyncPipelineEngine
+from .audio_cache import AudioCache
+from .audio_stream import WavStreamSegmenter
+from .emotion import EmotionTable
+from .history_store import HistoryJournal
+from .http_pool import ConnectionPool
+from .memory_index import MemoryIndex
+from .metrics import LatencyStats, TurnTimeline
+from .queues import AudioSegmentQueue, BoundedQueue, ReplyQueue
+from .resilience import LLMEndpoint, StreamRace, backoff_delay, is_retryable
+from .tokens import estimate_messages_tokens
+from .turn_store import MessageView, TurnRecord, TurnStore
+from .turn_stream import TurnStream
+from .voice_store import VoiceFileStore
+
+# 配置日志：只为本包的日志器添加处理器，日志文件在写入第一条日志时才打开(并清空)
+_log_handler = logging.FileHandler("VisualNovelAIAssistant.log", mode="w", encoding="utf-8", delay=True)
+_log_handler.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+_package_logger = logging.getLogger(__name__)
+_package_logger.addHandler(_log_handler)
+_package_logger.setLevel(logging.INFO)
+
+# 工作线程退出标记
+_STOP = object()
+
+
+def _completed_future(result):
+    """返回一个已完成的 Future"""
+    future = Future()
+    future.set_result(result)
+    return future
 
 class VisualNovelAIAssistant:
     def __init__(self, api_key, reply_queue ,api_url="https://api.openai.com/v1/chat/completions",
-                 base_prompt="你是一个人工智能助手", model="gpt-3.5-turbo", default_params=None):
+                 base_prompt="你是一个人工智能助手", model="gpt-3.5-turbo", default_params=None,
+                 tts_workers=4, engine="threads", lazy_start=False, queue_maxsize=64):
         """
         初始化客户端
         :param api_key: OpenAI API 密钥
@@ -34,6 +60,11 @@ class VisualNovelAIAssistant:
         :param base_prompt: 初始系统提示
         :param model: 使用的模型，默认为 gpt-3.5-turbo
         :param default_params: 默认参数，默认为空字典
+        :param tts_workers: 并发语音合成的线程数，默认为4
+        :param engine: 流水线实现，"threads" 为多线程，"asyncio" 为单线程事件循环
+            (asyncio 使用内置的 HTTP 客户端，只支持 http:// 代理，不支持 SOCKS 代理)
+        :param lazy_start: 为 True 时不在初始化时启动线程，第一次请求或预热时再启动
+        :param queue_maxsize: 内部各队列的容量上限，队列满时上游等待(背压)，0 为不限
         """
 
         # LLM 配置
@@ -65,36 +96,151 @@ class VisualNovelAIAssistant:
             }
         ]
 
+        # Live2D 动作和表情：由 set_emotions 设置后，模型可以为每句回复标注 <em> 标签
+        self.emotion_table = None
+        self._emotion_prompt = None
+        self._emotions = {} # seq -> (动作, 表情)，组装回复包时取出
+
         self.summary_prompt = {
             "role": "user",
             "content": "总结之前的对话内容,保留核心信息同时尽可能简洁,总结应带有明显的角色思维情感特征"
         }
         self.default_params = default_params if default_params is not None else {}
-        self.summarize_length = 8
+
+        # 请求容错：首个数据块时限、退避重试和备用接口
+        self.first_token_timeout = 15.0 # 发出请求后等待首个数据块的最长时间(秒)
+        self.llm_max_retries = 2 # 网络错误、超时、429 和 5xx 时的最大重试次数
+        self.retry_backoff = 0.5 # 重试退避的基础时间(秒)，按次数指数增长并随机抖动
+        self.retry_backoff_max = 4.0
+        self.fallback_api_url = None # 备用接口，重试时与主接口轮流使用
+        self.fallback_api_key = None # 为 None 时使用 api_key
+        self.fallback_model = None # 为 None 时使用 model
+        self.hedge_delay = None # 设置后主接口超过该秒数仍无数据时，同时向备用接口发出请求，先返回者胜出
+        self.summarize_token_budget = 6000 # 提示词(系统提示+历史)估算超过该 token 数时触发总结
+        self.summarize_keep_turns = 2 # 总结时保留不压缩的最近轮数
+
+        # 长期记忆：已移出上下文的对话建立本地检索索引，每轮按相关度取回几轮放在用户输入之前
+        self.memory_index = MemoryIndex() # 为 None 时不检索
+        self.memory_top_k = 3 # 每轮最多取回的对话轮数
+        self.memory_token_budget = 400 # 取回对话的估算 token 总数上限
+        self.memory_replaces_summary = False # 为 True 时超出预算不再请求 LLM 总结，直接将较早的对话移出上下文
+        self.memory_wait_timeout = 0.2 # 检索索引仍在后台建立时，每轮最多等待的秒数，超时则本轮不检索
+
+        # 提示词布局："prefix_cache" 将系统提示放在最前、历史只追加，以命中服务端前缀缓存；
+        # "legacy" 为旧布局(历史在系统提示之前)
+        self.prompt_layout = "prefix_cache"
+        self.turn_metrics = deque(maxlen=100) # 每轮的首 token 延迟和缓存命中统计
+
+        # 每轮耗时统计，metrics_path 不为空时每隔 metrics_interval 秒导出一次
+        self.stats = LatencyStats()
+        self.metrics_path = None
+        self.metrics_interval = 60.0
+        self._last_metrics_dump = time.perf_counter()
+        self._turn_ids = count()
+
+        # 打断：编号不大于 _cancelled_turn 的轮次全部作废
+        self.cancel_keep_partial = True # 被打断时是否将已显示的部分回复写入历史
+        self._cancel_lock = threading.Lock()
+        self._last_turn = -1
+        self._cancelled_turn = -1
+        self._active_response = None
+        self._active_timeline = None
+        self._undelivered_seqs = set() # 打断时从回复队列中撤回的句子
         self.use_tts = False
 
+        # LLM、总结和 TTS 共用的 HTTP 连接池
+        self.http_pool = self._create_http_pool(max(16, tts_workers * 2))
+        self.keepalive_interval = 30.0 # 连接空闲超过该秒数时发送探测请求保活，为 0 时不保活
+
         # TTS 配置
         self.tts_api_url = "http://127.0.0.1:8000/synthesize"
-
-        # 消息历史
-        self.history    = []
-        self.history_cn = []
-        self.history_jp = []
+        self.tts_workers = max(1, tts_workers)
+        self.tts_params = {} # 附加到合成请求中的语音参数
+        self.audio_cache = AudioCache() # 默认只缓存在内存中，传入 cache_dir 时同时写入磁盘；为 None 时不使用缓存
+        self.tts_binary = False # 为 True 时请求 TTS 服务直接返回二进制音频，省去 Base64 编码
+        self.voice_store = None # 设置为 VoiceFileStore 时由后台线程预先写好语音文件
+        self.tts_streaming = False # 为 True 时以流式接收语音，首个片段到达即可开始播放
+
+        # 消息历史：每轮一条 TurnRecord，history / history_cn / history_jp 为按需生成的只读视图
+        self.history_lock = threading.Lock()
+        self.turns = TurnStore(max_turns=200) # 内存中最多保留的轮数，更早的轮次只在对话日志中
+        self.history_cn = MessageView(self.turns, "cn", self.history_lock)
+        self.history_jp = MessageView(self.turns, "jp", self.history_lock)
+        self._history_ready = threading.Event() # 后台加载历史期间清除，对话线程在组装请求前等待
+        self._history_ready.set()
+        self._memory_ready = threading.Event() # 后台建立检索索引期间清除，检索前等待
+        self._memory_ready.set()
+
+        # 对话日志，每轮完成时追加写入
+        self.history_dir = "history"
+        self.history_tail_turns = 50 # 启动时加载的中日文历史轮数
+        self.history_journal = self._create_history_journal()
 
         # 日志和状态
         self.logger = logging.getLogger(__name__)
         self.is_running = True
 
-        self.input_queue = Queue()
-        self.jp_queue = Queue()    # 日文文本队列
-        self.cn_queue = Queue()    # 中文文本队列
-        self.jp_queue_tts = Queue()  # 待处理的日文文本队列
-        self.sound_queue = Queue() # 日文语音队列
-        self.reply_queue = reply_queue # 回复队列
+        # 内部队列有容量上限：游戏取回复变慢时上游逐级等待，内存占用保持有界
+        self.queue_maxsize = queue_maxsize
+        self.input_queue = BoundedQueue(queue_maxsize)
+        self.jp_queue = BoundedQueue(queue_maxsize)    # 日文文本队列
+        self.cn_queue = BoundedQueue(queue_maxsize)    # 中文文本队列
+        self.jp_queue_tts = BoundedQueue(queue_maxsize)  # 待处理的日文文本队列
+        self.sound_queue = BoundedQueue(queue_maxsize) # 日文语音队列
+        self.summary_queue = Queue() # 总结请求队列
+        self._summary_pending = False
+        self.reply_queue = reply_queue # 回复队列，使用 ReplyQueue 时语音数据的总字节数也有上限
+        self.join_drops = 0 # 组装回复包时因 seq 对不齐而丢弃的条目数
 
         self.sequence_lock = threading.Lock()
         self.sequence_counter = 0
 
+        # 按 seq 顺序排列的在途合成任务
+        self._tts_pending = deque()
+        self._tts_pending_lock = threading.Lock()
+        # 已提交但尚未放入 sound_queue 的合成数上限(含等待前一句的已完成结果和分发线程为下一句预留的名额)，
+        # 达到上限时分发线程不再取出新的文本，0 为不限
+        self.tts_max_in_flight = self.tts_workers * 2
+        self._tts_in_flight = 0
+        self._tts_slots = threading.Condition()
+        self.tts_stalls = 0 # 分发线程因在途合成达到上限而等待的次数
+        self.tts_stall_time = 0.0 # 分发线程等待的总时长(秒)
+
+        self.engine = engine
+        self._engine = None # asyncio 流水线，engine 为 "asyncio" 时使用
+        self.dialog_thread = self.monitor_thread = self.tts_thread = self.summary_thread = None
+        self._started = False
+        self._start_lock = threading.Lock()
+
+        if not lazy_start:
+            self._ensure_started()
+
+    def _create_http_pool(self, pool_maxsize):
+        """创建 HTTP 连接池"""
+        return ConnectionPool(pool_maxsize=pool_maxsize)
+
+    def _create_history_journal(self):
+        """创建 history_dir 下的对话日志"""
+        return HistoryJournal(os.path.join(self.history_dir, "journal.jsonl"), keep_turns=self.history_tail_turns)
+
+    def _ensure_started(self):
+        """首次调用时启动工作线程"""
+        with self._start_lock:
+            if self._started or not self.is_running:
+                return
+            self._started = True
+            start_time = time.perf_counter()
+            self._start_workers()
+            self.logger.info("Workers started in %.1f ms", (time.perf_counter() - start_time) * 1000)
+
+    def _start_workers(self):
+        """启动对话、TTS 和监控线程，或 asyncio 流水线"""
+        if self.engine == "asyncio":
+            self.dialog_thread = self.monitor_thread = self.tts_thread = self.summary_thread = None
+            self._engine = AsyncPipelineEngine(self)
+            self._engine.start()
+            return
+
         # 启动对话线程
         self.dialog_thread = threading.Thread(target=self._dialog_thread, daemon=True)
         self.dialog_thread.start()
@@ -107,90 +253,414 @@ class VisualNovelAIAssistant:
         self.tts_thread = threading.Thread(target=self._tts_thread, daemon=True)
         self.tts_thread.start()
 
+        # 启动后台总结线程
+        self.summary_thread = threading.Thread(target=self._summary_thread, daemon=True)
+        self.summary_thread.start()
+
+    def set_emotions(self, motions, exps=()):
+        """
+        设置可用的 Live2D 动作和表情，应在启动时调用一次
+        查找表只在此时构建，可用名字以一条固定的系统提示告知模型
+        :param motions: 动作名列表(如 CharacterPreprocessor.motions)
+        :param exps: 表情名列表(如 CharacterPreprocessor.exps)
+        """
+        table = EmotionTable(motions, exps)
+        if self._emotion_prompt is not None:
+            self.base_prompt.remove(self._emotion_prompt)
+            self._emotion_prompt = None
+
+        self.emotion_table = table if table else None
+        if self.emotion_table is not None:
+            self._emotion_prompt = table.prompt()
+            self.base_prompt.append(self._emotion_prompt)
+        self.logger.info("Emotions set: %d motions, %d expressions", len(table.motions), len(table.exps))
+
+    def _set_emotion(self, seq, content):
+        """记录一句回复的 <em> 标签，未设置动作表情时忽略"""
+        table = self.emotion_table
+        if table is None:
+            return
+        motion, exp = table.resolve(content)
+        if motion is not None or exp is not None:
+            self._emotions[seq] = (motion, exp)
+
     def load_history(self):
         """
-        从文件中加载消息历史
+        从对话日志尾部加载消息历史,首次运行时导入旧版 pkl 历史
         """
+        start_time = time.perf_counter()
         try:
-            # 加载消息历史
-            if os.path.exists("history/history.pkl"):
-                with open("history/history.pkl", "rb") as f:
-                    self.history = pickle.load(f)
-            else:
-                self.logger.info("history/history.pkl does not exist")
+            if not self.history_journal.exists():
+                self._import_legacy_history()
+
+            summary, turns = self.history_journal.load_tail(self.history_tail_turns)
+
+            # 上下文：最新总结 + 总结之后的对话
+            records = [TurnRecord.from_journal(turn) for turn in turns]
+            with self.history_lock:
+                if summary:
+                    self.turns.reset(records, summary["content"], summary["until"])
+                else:
+                    self.turns.reset(records)
+            self.logger.info("History loaded: %d turns in %.1f ms", len(turns), (time.perf_counter() - start_time) * 1000)
+        except Exception as e:
+            self.logger.error(f"Error loading history: {e}")
+        finally:
+            self._history_ready.set()
 
-            # 加载中文消息历史
-            if os.path.exists("history/history_cn.pkl"):
-                with open("history/history_cn.pkl", "rb") as f:
-                    self.history_cn = pickle.load(f)
-            else:
-                self.logger.info("history/history_cn.pkl does not exist")
+        # 索引读取归档可能较慢，不推迟第一轮对话；检索时另行等待索引建立完成
+        try:
+            if self.memory_index is not None:
+                self._build_memory_index()
+        finally:
+            self._memory_ready.set()
 
-            # 加载日文消息历史
-            if os.path.exists("history/history_jp.pkl"):
-                with open("history/history_jp.pkl", "rb") as f:
-                    self.history_jp = pickle.load(f)
-            else:
-                self.logger.info("history/history_jp.pkl does not exist")
+    def _build_memory_index(self):
+        """从对话日志(含归档)读取最近的轮次建立检索索引"""
+        start_time = time.perf_counter()
+        try:
+            for turn in self.history_journal.read_turns(float("inf"), self.memory_index.max_docs):
+                self.memory_index.add(TurnRecord.from_journal(turn))
+            self.logger.info("Memory index built: %d turns in %.1f ms", len(self.memory_index),
+                             (time.perf_counter() - start_time) * 1000)
         except Exception as e:
-            self.logger.error(f"Error loading history: {e}")
+            self.logger.error(f"Error building memory index: {e}")
 
-    def save_history(self):
+    def load_history_async(self):
+        """
+        在后台线程加载历史，不阻塞启动；第一轮对话会等待加载完成后再组装请求
         """
-        保存消息历史到文件
+        self._history_ready.clear()
+        self._memory_ready.clear()
+        threading.Thread(target=self.load_history, name="history-load", daemon=True).start()
+
+    def wait_history(self, timeout=None):
+        """
+        等待后台加载历史完成
+        :return: 是否已加载完成
+        """
+        return self._history_ready.wait(timeout)
+
+    def _import_legacy_history(self):
+        """将旧版 history/*.pkl 转换为对话日志"""
+        paths = [os.path.join(self.history_dir, name) for name in ("history.pkl", "history_cn.pkl", "history_jp.pkl")]
+        if not all(os.path.exists(path) for path in paths):
+            self.logger.info("No legacy history to import")
+            return
+
+        loaded = []
+        for path in paths:
+            with open(path, "rb") as f:
+                loaded.append(pickle.load(f))
+        history, history_cn, history_jp = loaded
+
+        def pairs(messages):
+            return [(messages[i]["content"], messages[i + 1]["content"])
+                    for i in range(0, len(messages) - 1, 2)
+                    if messages[i]["role"] == "user" and messages[i + 1]["role"] == "assistant"]
+
+        turn_id = -1
+        for (user, cn), (_, jp) in zip(pairs(history_cn), pairs(history_jp)):
+            turn_id = self.history_journal.append_turn(user, cn, jp)
+
+        if history and history[0]["role"] == "assistant":
+            recent_turns = len(pairs(history[1:]))
+            self.history_journal.append_summary(history[0]["content"], until=turn_id - recent_turns)
+
+        self.logger.info("Legacy history imported: %d turns", turn_id + 1)
+
+    @property
+    def history(self):
+        """发送给 API 的上下文消息(最新总结 + 之后的对话)，每次调用时生成"""
+        with self.history_lock:
+            return self.turns.context_messages()
+
+    def page_history(self, before_id=None, limit=50):
         """
+        从对话日志分页读取已不在内存中的较早轮次
+        :param before_id: 只返回编号小于该值的轮次，默认为内存中最早的一轮
+        :param limit: 最多返回的轮数
+        :return: 按时间顺序排列的 TurnRecord
+        """
+        if before_id is None:
+            with self.history_lock:
+                before_id = self.turns[0].id if len(self.turns) else self.turns.last_id + 1
+        return [TurnRecord.from_journal(turn) for turn in self.history_journal.read_turns(before_id, limit)]
 
+    def save_history(self):
+        """
+        压缩对话日志(每轮对话在完成时已写入)
+        """
         try :
-            # 检测文件夹是否存在
-            if not os.path.exists("history"):
-                os.makedirs("history")
+            self.wait_history()
+            self.history_journal.compact()
+        except Exception as e:
+            self.logger.error(f"Error saving history: {e}")
 
-            with open("history/history.pkl", "wb") as f:
-                pickle.dump(self.history, f)
+    def close(self, timeout=5.0):
+        """
+        停止所有工作线程并等待其退出
+        :param timeout: 每个线程的最长等待时间(秒)
+        """
+        self.is_running = False
+
+        # 向每个阻塞中的队列投递退出标记，并解除因队列满而等待的 put
+        for queue in (self.input_queue, self.jp_queue_tts, self.jp_queue, self.cn_queue, self.sound_queue):
+            queue.close(_STOP)
+        self.summary_queue.put(_STOP)
+        if isinstance(self.reply_queue, BoundedQueue):
+            self.reply_queue.close()
+        with self._tts_slots:
+            self._tts_slots.notify_all()
+
+        if self._engine is not None:
+            self._engine.close(timeout)
+
+        for thread in (self.dialog_thread, self.tts_thread, self.monitor_thread, self.summary_thread):
+            if thread is not None and thread is not threading.current_thread():
+                thread.join(timeout)
+
+        self.http_pool.close()
+        self.dump_metrics()
+        self.logger.info("Session closed")
 
-            with open("history/history_cn.pkl", "wb") as f:
-                pickle.dump(self.history_cn, f)
+    def warm_up(self):
+        """
+        在后台预先与 LLM 和 TTS 服务建立连接并启动保活，
+        应在配置完 use_tts、tts_api_url 等属性后调用
+        """
+        self._ensure_started()
+        urls = [self.api_url]
+        if self.use_tts:
+            urls.append(self.tts_api_url)
+
+        if self._engine is not None:
+            # asyncio 流水线的请求不经过 http_pool，空闲时间以其自己的客户端为准
+            ping, last_used = self._engine.warm, self._engine.last_used
+        else:
+            ping, last_used = self.http_pool.warm, None
+        threading.Thread(target=ping, args=(urls,), name="http-warm", daemon=True).start()
+        self.http_pool.keep_alive(urls, self.keepalive_interval, ping, last_used)
+
+    def start_fetching(self, prompt, interrupt=False):
+        """
+        启动后台线程以获取ChatAPI的响应
+        :param prompt: 用户输入的提示
+        :param interrupt: 为 True 时先打断仍在进行中的回复
+        :return: 本轮编号，与回复包的 'turn' 字段对应；打断时已在途的旧轮次回复包可据此丢弃
+        """
+        if interrupt:
+            self.cancel()
 
-            with open("history/history_jp.pkl", "wb") as f:
-                pickle.dump(self.history_jp, f)
+        timeline = TurnTimeline(next(self._turn_ids), prompt)
+        with self._cancel_lock:
+            self._last_turn = timeline.turn_id
 
-            with open("history/history.json", 'w', encoding='utf-8') as file:
-                json.dump(self.history, file, ensure_ascii=False, indent=4)
+        self._enqueue_input({'text': prompt, 'timeline': timeline})
+        return timeline.turn_id
 
-            with open("history/history_cn.json", 'w', encoding='utf-8') as file:
-                json.dump(self.history_cn, file, ensure_ascii=False, indent=4)
+    def _enqueue_input(self, item):
+        """将一轮输入交给对话线程或 asyncio 流水线"""
+        self._ensure_started()
+        if self._engine is not None:
+            self._engine.submit(item)
+            return
 
-            with open("history/history_jp.json", 'w', encoding='utf-8') as file:
-                json.dump(self.history_jp, file, ensure_ascii=False, indent=4)
-        except Exception as e:
-            self.logger.error(f"Error loading history: {e}")
+        try:
+            # 在游戏线程中调用，不能等待
+            self.input_queue.put(item, block=False)
+        except Full:
+            with self.input_queue.mutex:
+                self.input_queue.drops += 1
+            self.logger.warning("Input queue full, turn %d dropped", item['timeline'].turn_id)
+            # 回复队列也可能已满，在后台线程中发出结束标记，游戏线程不等待
+            threading.Thread(target=self._emit_reply, daemon=True,
+                             args=(self._get_sequence_number(), item['timeline'], None, None, None, None, "busy")).start()
+
+    def cancel(self):
+        """
+        打断所有已提交的轮次：关闭正在接收的流式响应，跳过尚未开始的语音合成，
+        并撤回回复队列中尚未取出的回复包。应在取出回复的线程(游戏线程)中调用
+        """
+        streams = []
+        with self._cancel_lock:
+            if self._cancelled_turn >= self._last_turn:
+                return
+            self._cancelled_turn = self._last_turn
+            response = self._active_response
+            timeline = self._active_timeline
+
+            # 撤回尚未显示的回复包：与 _emit_reply 的检查和放入在同一把锁内，
+            # 撤回之后不会再有被打断轮次的回复包放入
+            while True:
+                try:
+                    package = self.reply_queue.get_nowait()
+                except Empty:
+                    break
+                if package and package.get('seq') is not None:
+                    self._undelivered_seqs.add(package['seq'])
+                if package and package.get('audio_stream') is not None:
+                    streams.append(package['audio_stream'])
+
+        if timeline is not None:
+            timeline.mark("cancelled")
+        for stream in streams:
+            stream.discard()
+
+        # 关闭连接，停止接收不再需要的 token
+        if response is not None:
+            try:
+                response.close()
+            except Exception:
+                pass
+        if self._engine is not None:
+            self._engine.cancel_active()
+
+        self.logger.info("Turns up to %d cancelled", self._cancelled_turn)
+
+    def _is_cancelled(self, timeline):
+        return timeline is not None and timeline.turn_id <= self._cancelled_turn
+
+    def get_stats(self):
+        """
+        返回耗时统计(毫秒)、音频缓存命中率和最近几轮的时间线
+        """
+        return {
+            "latency": self.stats.summary(),
+            "audio_cache": self.audio_cache.stats() if self.audio_cache else None,
+            "connections": self.get_connection_stats(),
+            "queues": self.get_queue_stats(),
+            "recent_turns": self.stats.recent(),
+        }
 
-    def close(self):
-        """关闭会话并记录日志"""
-        self.logger.info("Session closed")
+    def get_queue_stats(self):
+        """
+        返回各队列的长度、上限、因队列满而等待的次数和时长以及丢弃数
+        """
+        queues = {"input": self.input_queue, "jp": self.jp_queue, "cn": self.cn_queue,
+                  "jp_tts": self.jp_queue_tts, "sound": self.sound_queue}
+        stats = {name: queue.stats() for name, queue in queues.items()}
+        if isinstance(self.reply_queue, BoundedQueue):
+            stats["reply"] = self.reply_queue.stats()
+        stats["join_drops"] = self.join_drops
+        if self._engine is not None:
+            stats["asyncio"] = self._engine.queue_stats()
+        else:
+            with self._tts_slots:
+                stats["tts_in_flight"] = {
+                    "size": self._tts_in_flight,
+                    "maxsize": self.tts_max_in_flight,
+                    "stalls": self.tts_stalls,
+                    "stall_ms": round(self.tts_stall_time * 1000, 1),
+                }
+        return stats
+
+    def get_connection_stats(self):
+        """
+        返回 HTTP 连接的建立数、请求数和复用数
+        """
+        stats = self.http_pool.stats()
+        if self._engine is not None:
+            stats["asyncio"] = self._engine.connection_stats()
+        return stats
 
-    def start_fetching(self, prompt):
+    def dump_metrics(self, path=None):
         """
-        启动后台线程以获取ChatAPI的响应
-        :param prompt: 用户输入的提示
+        将统计结果写入 JSON 文件
+        :param path: 输出路径，默认为 metrics_path
         """
-        self.input_queue.put(prompt)
+        path = path or self.metrics_path
+        if not path:
+            return
+        try:
+            self.stats.dump(path, {"audio_cache": self.audio_cache.stats() if self.audio_cache else None,
+                                   "connections": self.get_connection_stats()})
+        except OSError as e:
+            self.logger.error(f"Error dumping metrics: {e}")
+        self._last_metrics_dump = time.perf_counter()
+
+    def _request_summary(self):
+        """提示词超出 token 预算时，请求后台线程进行总结"""
+        with self.history_lock:
+            prompt_tokens = estimate_messages_tokens(self.base_prompt) + self.turns.context_tokens()
+            if prompt_tokens <= self.summarize_token_budget or self._summary_pending:
+                return
+            self._summary_pending = True
+
+        self.logger.info("Prompt tokens %d over budget %d, summary requested", prompt_tokens, self.summarize_token_budget)
+        self._schedule_summary(prompt_tokens)
+
+    def _schedule_summary(self, prompt_tokens):
+        """交给后台执行总结"""
+        if self._engine is not None:
+            self._engine.summarize()
+        else:
+            self.summary_queue.put(prompt_tokens)
+
+    def _summary_thread(self):
+        """后台总结线程：压缩较早的对话，不阻塞下一轮对话"""
+        while self.is_running:
+            prompt_tokens = self.summary_queue.get()
+            if prompt_tokens is _STOP:
+                break
+            self._run_summary()
+
+    def _run_summary(self):
+        try:
+            self._summarize()
+        finally:
+            with self.history_lock:
+                self._summary_pending = False
 
     def _summarize(self):
-        self.logger.info("history len: " + str(len(self.history)))
-        if len(self.history) > self.summarize_length:
-            self.logger.info("Start summarizing")
-            # 复制历史并添加总结提示
-            temp_history = self.history.copy()
-            temp_history.append(self.summary_prompt)
-            # 发送总结请求
-            summary_content = self._get_chat_response_sync(messages = temp_history)
-            # 清空历史并添加总结
-            if summary_content:
-                self.logger.info(f"Summarize success")
-                self.history = [{"role": "assistant", "content": summary_content}]
-            else:
-                self.logger.info(f"Summarize failed")
+        # 只总结较早的对话，保留最近几轮原文
+        with self.history_lock:
+            context = self.turns.context_turns()
+            split = len(context) - self.summarize_keep_turns
+            if split < 1:
+                return
+            older = [self.turns.summary_message()] if self.turns.summary is not None else []
+            for turn in context[:split]:
+                older.extend(turn.messages())
+            until = context[split - 1].id
+
+            if self.memory_replaces_summary and self.memory_index is not None:
+                # 较早的对话已在检索索引中，直接移出上下文，不请求 LLM
+                self.turns.set_summary(self.turns.summary, until)
+                try:
+                    self.history_journal.append_summary(self.turns.summary, until=until)
+                except Exception as e:
+                    self.logger.error(f"Error writing history journal: {e}")
+                self.logger.info("Moved %d turns out of context into long-term memory", split)
+                return
+
+        self.logger.info("Start summarizing %d messages", len(older))
+        start_time = time.perf_counter()
+
+        # 复制历史并添加总结提示
+        temp_history = older.copy()
+        temp_history.append(self.summary_prompt)
+        # 发送总结请求
+        summary_content = self._get_chat_response_sync(messages = temp_history)
+
+        elapsed = time.perf_counter() - start_time
+        self.stats.record_value("summarize", elapsed * 1000)
+        if not summary_content:
+            self.logger.info("Summarize failed after %.2f s", elapsed)
+            return
+
+        summary_message = {"role": "assistant", "content": summary_content}
+
+        # 原子替换：总结期间追加的对话保留在总结之后
+        with self.history_lock:
+            self.turns.set_summary(summary_content, until)
+            try:
+                self.history_journal.append_summary(summary_content, until=until)
+            except Exception as e:
+                self.logger.error(f"Error writing history journal: {e}")
+
+        saved_tokens = estimate_messages_tokens(older) - estimate_messages_tokens([summary_message])
+        self.logger.info("Summarize success in %.2f s, saved about %d prompt tokens", elapsed, saved_tokens)
 
     def _get_chat_response_sync(self, messages, timeout=40):
         """使用同步的HTTP请求获取AI响应"""
@@ -207,14 +677,9 @@ class VisualNovelAIAssistant:
             }
 
             # 发送请求
-            response = requests.request(
-                "POST",
+            response = self.http_pool.post(
                 self.api_url,
-                headers={
-                    'Content-Type': 'application/json',
-                    'Accept': 'application/json',
-                    "Authorization": f"Bearer {self.api_key}"
-                },
+                headers={**self._llm_headers(), 'Accept': 'application/json'},
                 json=params,
                 timeout=timeout
             )
@@ -251,198 +716,556 @@ class VisualNovelAIAssistant:
         :param timeout: 请求超时时间，默认为40秒
         """
 
-        # HTTP 长链接
-        session = requests.Session()
-        session.headers.update({
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.api_key}"
-        })
+        while self.is_running:
 
-        adapter = requests.adapters.HTTPAdapter(pool_connections=10, pool_maxsize=100)
-        session.mount('https://', adapter)
+            # 阻塞等待用户输入
+            item = self.input_queue.get()
+            if item is _STOP:
+                break
 
-        while self.is_running:
+            self._handle_input(item, timeout)
 
-            if not self.input_queue.empty():
+    def _handle_input(self, item, timeout=40):
+        """
+        处理一轮输入：请求 LLM 并解析流式回复
+        :param item: {'text': 用户输入, 'timeline': TurnTimeline}
+        """
+        text = item['text']
+        timeline = item['timeline']
 
-                text = self.input_queue.get()
+        # 已被打断的输入不再请求
+        if self._is_cancelled(timeline):
+            return
 
-                try:
-                    # 创建临时历史记录
-                    temp_history = self.history.copy()
-                    temp_history.extend(self.base_prompt)
-                    temp_history.append({"role": "user", "content": text})
+        # 历史仍在后台加载时等待加载完成
+        self.wait_history()
 
-                    # 创建请求数据
-                    request_data = {
-                        "model": self.model,
-                        "messages": temp_history,
-                        "stream": True,
-                        "max_tokens" : 8192,
-                        "frequency_penalty":2.0,
-                        "temperature":1.3,
-                        "presence_penalty": 1.0,
-                        **self.default_params
-                    }
+        # 创建请求数据
+        request_data = self._build_request_data(text, timeline)
+        self.logger.info("Sending request to LLM API, Request data: %s", request_data)
 
-                    self.logger.info("Sending request to LLM API, Request data: %s", request_data)
+        with self._cancel_lock:
+            self._active_timeline = timeline
+        stream = None
+        try:
+            timeline.mark("request_sent")
+            stream, stream_info = self._open_llm_stream(request_data, timeline, timeout)
+            if stream is None:
+                # 等待期间被打断
+                self._end_turn(timeline)
+                return
 
-                    response = session.post(
-                        self.api_url,
-                        data=json.dumps(request_data),
-                        timeout=timeout,
-                        stream=True
-                    )
+            self.logger.info("Response received from LLM API")
+            self._process_stream(text, stream, timeline, stream_info)
 
-                    response.raise_for_status()  # 检查HTTP错误
+        except Exception as e:
+            # 所有尝试都失败：仍然发出结束标记，游戏不会一直等待
+            self.logger.error("Error occurred while fetching response: %s", str(e))
+            self._end_turn(timeline, error=str(e))
+        finally:
+            with self._cancel_lock:
+                self._active_response = None
+                self._active_timeline = None
+            if stream is not None:
+                stream.close()
+
+    def _llm_endpoints(self):
+        """主接口及备用接口(已配置时)"""
+        endpoints = [LLMEndpoint("primary", self.api_url, self.api_key, self.model)]
+        if self.fallback_api_url:
+            endpoints.append(LLMEndpoint("fallback", self.fallback_api_url,
+                                         self.fallback_api_key or self.api_key, self.fallback_model or self.model))
+        return endpoints
+
+    def _open_llm_stream(self, request_data, timeline, timeout):
+        """
+        发出流式请求并等到首个数据块，失败时带退避重试(有备用接口时轮流使用)
+        :return: (胜出的 StreamAttempt, 本轮请求信息)，被打断时为 (None, None)
+        """
+        endpoints = self._llm_endpoints()
+        hedging = self.hedge_delay is not None and len(endpoints) > 1
+        error = None
+
+        for attempt in range(self.llm_max_retries + 1):
+            if attempt:
+                delay = backoff_delay(attempt - 1, self.retry_backoff, self.retry_backoff_max)
+                self.logger.info("Retrying LLM request in %.2f s (attempt %d)", delay, attempt + 1)
+                time.sleep(delay)
+
+            if self._is_cancelled(timeline) or not self.is_running:
+                return None, None
+
+            primary = endpoints[attempt % len(endpoints)]
+            hedge = endpoints[(attempt + 1) % len(endpoints)] if hedging else None
+
+            race = StreamRace(self.http_pool, request_data, timeout, self.logger)
+            with self._cancel_lock:
+                self._active_response = race
+            if self._is_cancelled(timeline):
+                return None, None
+
+            stream, error = race.run(primary, self.first_token_timeout, hedge, self.hedge_delay)
+            if stream is not None:
+                with self._cancel_lock:
+                    self._active_response = stream
+                return stream, {"endpoint": stream.endpoint.name, "attempts": attempt + 1, "hedged": race.hedged}
+
+            if self._is_cancelled(timeline):
+                return None, None
+            if not is_retryable(error):
+                break
 
-                    self.logger.info( "Response received from LLM API")
+        raise error
 
-                    self._process_stream( text,response )
+    def _llm_headers(self):
+        return {"Content-Type": "application/json", "Authorization": f"Bearer {self.api_key}"}
 
-                except requests.exceptions.RequestException as e:
-                    self.logger.error("Error occurred while fetching response: %s", str(e))
-            else :
-                time.sleep(0.1)
+    def _build_request_data(self, text, timeline=None):
+        """
+        组装流式请求的请求体
+        :param text: 用户输入
+        :param timeline: 本轮的时间线，用于记录检索耗时
+        """
+        return {
+            "model": self.model,
+            "messages": self._build_messages(text, timeline),
+            "stream": True,
+            "stream_options": {"include_usage": True}, # 在最后一个数据块中返回 usage
+            "max_tokens" : 8192,
+            "frequency_penalty":2.0,
+            "temperature":1.3,
+            "presence_penalty": 1.0,
+            **self.default_params
+        }
 
-    def _process_stream(self, text , response ):
+    def _build_messages(self, text, timeline=None):
+        """
+        组装请求消息
+        :param text: 用户输入
+        :param timeline: 本轮的时间线，用于记录检索耗时
+        """
+        with self.history_lock:
+            history = self.turns.context_messages()
+            summary_until = self.turns.summary_until
 
-        final_response = "" # 完整回复
-        final_response_cn = "" # 中文回复
-        final_response_jp = "" # 日文回复
-        response_buffer = "" # 字符串处理缓冲区
+        if self.prompt_layout == "legacy":
+            messages = history + self.base_prompt
+        else:
+            # 系统提示在前且不变，历史只在末尾追加，保证请求前缀逐字节稳定
+            messages = self.base_prompt + history
 
-        response_phase = 0
+        # 取回的往事放在用户输入之前，不影响前面的缓存前缀
+        memory = self._recall(text, summary_until, timeline)
+        if memory is not None:
+            messages.append(memory)
 
-        seq = self._get_sequence_number()
+        messages.append({"role": "user", "content": text})
+        return messages
 
-        for line in response.iter_lines():
-            if not self.is_running:
-                break
+    def _recall(self, text, max_id, timeline=None):
+        """
+        从长期记忆中检索与输入相关的往事
+        :param max_id: 只检索编号不大于该值的轮次(之后的轮次仍在上下文中)
+        :return: system 消息，没有相关内容时为 None
+        """
+        if self.memory_index is None or max_id < 0:
+            return None
+
+        start_time = time.perf_counter()
+        if not self._memory_ready.wait(self.memory_wait_timeout):
+            self.logger.info("Memory index not ready, recall skipped")
+            return None
+        memories = self.memory_index.select(text, self.memory_top_k, max_id, self.memory_token_budget)
+        if timeline is not None:
+            timeline.mark("retrieval_start", start_time)
+            timeline.mark("retrieval_end")
+        if not memories:
+            return None
+
+        self.logger.info("Recalled turns %s in %.1f ms", [turn_id for turn_id, *_ in memories],
+                         (time.perf_counter() - start_time) * 1000)
+        lines = ["以下是与当前话题相关的过往对话,可作为回忆参考:"]
+        for _, timestamp, user, reply in memories:
+            date = time.strftime("%Y-%m-%d", time.localtime(timestamp)) if timestamp else ""
+            lines.append(f"[{date}] 用户:{user}\n你:{reply}")
+        return {"role": "system", "content": "\n".join(lines)}
+
+    @staticmethod
+    def _parse_usage(usage):
+        """
+        解析 usage 字段中的缓存命中信息，兼容 DeepSeek 和 OpenAI 的字段名
+        :param usage: 流最后一个数据块中的 usage
+        """
+        prompt_tokens = usage.get("prompt_tokens", 0)
+        if "prompt_cache_hit_tokens" in usage:
+            cached_tokens = usage["prompt_cache_hit_tokens"]
+        else:
+            cached_tokens = (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "cached_tokens": cached_tokens,
+            "uncached_tokens": usage.get("prompt_cache_miss_tokens", prompt_tokens - cached_tokens),
+            "completion_tokens": usage.get("completion_tokens", 0),
+        }
 
-            if not line:
-                continue
+    def _process_stream(self, text , response, timeline=None, stream_info=None ):
+
+        if timeline is None:
+            timeline = TurnTimeline(next(self._turn_ids), text)
+        turn = TurnStream(self, text, timeline)
+        turn.metrics.update(stream_info or {})
 
-            line_str = line.decode('utf-8')
-            if not line_str.startswith("data: "):
+        error = None
+        lines = response.iter_lines()
+        while self.is_running and not self._is_cancelled(timeline):
+            try:
+                line = next(lines)
+            except StopIteration:
+                break
+            except Exception as e:
+                # 打断时连接被关闭；其他错误保留已收到的部分并结束本轮
+                if not self._is_cancelled(timeline):
+                    self.logger.error("Error occurred while reading response: %s", str(e))
+                    error = str(e)
+                break
+
+            try:
+                events = turn.feed_line(line)
+            except ValueError as e:
+                self.logger.warning("Malformed stream data skipped: %s", str(e))
                 continue
 
-            event_data = line_str[6:]
-            if event_data == "[DONE]":
+            for tag, seq, sentence in events:
+                self._put_sentence(tag, seq, sentence, timeline)
+            if turn.done:
                 break
 
-            chunk = json.loads(event_data)
-            if chunk:
-                content = chunk["choices"][0].get("delta", {}).get("content", "")
-                if content:
-
-                    final_response += content
-                    response_buffer += content
-
-                    jp_start = response_buffer.find('<jp>')
-                    if jp_start != -1:
-                        jp_end = response_buffer.find('</jp>', jp_start)
-                        if jp_end != -1:
-                            # 检测到一句完整的日文文本
-                            jp_content = response_buffer[jp_start+4:jp_end]
-                            final_response_jp += jp_content
-                            self.jp_queue.put({'seq': seq, 'content': jp_content})
-                            self.jp_queue_tts.put({'seq': seq, 'content': jp_content})
-                            response_buffer = response_buffer[jp_end+5:]
-                            response_phase = 1
-
-                    if response_phase == 1:
-                        cn_start = response_buffer.find('<cn>')
-                        if cn_start != -1:
-                            cn_end = response_buffer.find('</cn>', cn_start)
-                            if cn_end != -1:
-                                # 检测到一句完整的中文文本
-                                cn_content = response_buffer[cn_start+4:cn_end]
-                                final_response_cn += cn_content
-                                self.cn_queue.put({'seq': seq, 'content': cn_content})
-                                # 从缓冲区中移除已处理的内容
-                                response_buffer = response_buffer[cn_end+5:]
-                                # 申请新的序列号
-                                seq = self._get_sequence_number()
-                                response_phase == 0
-
-        if final_response:
-            self.logger.info("Received data: %s", final_response)
-
-        # 全部接收完成后将完整的中文回复和日文回复分别放入对应的消息队列
-        if final_response_cn and final_response_jp:
-            self.history.append({"role": "user", "content": text})
-            self.history.append({"role": "assistant", "content": final_response_cn})
-            self.history_cn.append({"role": "user", "content": text})
-            self.history_cn.append({"role": "assistant", "content": final_response_cn})
-            self.history_jp.append({"role": "user", "content": text})
-            self.history_jp.append({"role": "assistant", "content": final_response_jp})
-
-        self.jp_queue_tts.put({'seq': seq, 'content': None})
-        self.jp_queue.put({'seq': seq, 'content': None})
-        self.cn_queue.put({'seq': seq, 'content': None})
+        for tag, seq, sentence in turn.finish():
+            self._put_sentence(tag, seq, sentence, timeline)
+
+        self._finish_turn(turn)
+        self._end_turn(timeline, error)
+
+    def _end_turn(self, timeline, error=None):
+        """
+        发出回复结束标记
+        :param error: 本轮失败的原因，随结束标记交给游戏
+        """
         seq = self._get_sequence_number()
-        self._summarize()
+        self.jp_queue_tts.put({'seq': seq, 'content': None, 'timeline': timeline})
+        self.jp_queue.put({'seq': seq, 'content': None, 'timeline': timeline, 'error': error})
+        self.cn_queue.put({'seq': seq, 'content': None})
 
-    def _tts_thread(self):
+    def _put_sentence(self, tag, seq, sentence, timeline):
+        """将解析出的句子放入对应的队列"""
+        if tag == "jp":
+            self.jp_queue.put({'seq': seq, 'content': sentence, 'timeline': timeline})
+            self.jp_queue_tts.put({'seq': seq, 'content': sentence, 'timeline': timeline})
+        else:
+            self.cn_queue.put({'seq': seq, 'content': sentence})
 
-        session = requests.Session()
-        session.headers.update({
-            "Content-Type": "application/json"
-        })
-        adapter = requests.adapters.HTTPAdapter(pool_connections=10, pool_maxsize=100)
-        session.mount('http://', adapter)
+    def _finish_turn(self, turn):
+        """
+        一轮回复接收结束：记录统计，写入历史，必要时请求总结
+        :param turn: 本轮的 TurnStream
+        """
+        text = turn.text
+        timeline = turn.timeline
+        sentences = turn.sentences
+
+        final_response_jp = "".join(jp for _, jp, _ in sentences)
+        final_response_cn = "".join(cn for _, _, cn in sentences if cn is not None)
+
+        interrupted = self._is_cancelled(timeline)
+        if interrupted:
+            # 只保留打断前已交给游戏显示的句子
+            with self._cancel_lock:
+                shown = [(jp, cn if cn is not None else jp) for seq, jp, cn in sentences
+                         if seq in timeline.replies and seq not in self._undelivered_seqs]
+                self._undelivered_seqs.difference_update(seq for seq, _, _ in sentences)
+
+            timeline.mark("stream_closed")
+            cancel_ms = timeline.since("stream_closed", "cancelled")
+            if cancel_ms is not None:
+                self.stats.record_value("cancel", cancel_ms)
+            self.logger.info("Turn %d interrupted, %d of %d sentences shown", timeline.turn_id, len(shown), len(sentences))
+
+            if self.cancel_keep_partial and shown:
+                final_response_jp = "".join(jp for jp, _ in shown)
+                final_response_cn = "".join(cn for _, cn in shown)
+            else:
+                final_response_jp = final_response_cn = ""
 
-        while self.is_running:
-            if not self.jp_queue_tts.empty():
+        if turn.final_response:
+            self.logger.info("Received data: %s", turn.final_response)
+
+        metrics = turn.metrics
+        first_token = timeline.since("first_token", "request_sent")
+        metrics["first_token"] = None if first_token is None else first_token / 1000
+        timeline.usage = metrics
+        self.turn_metrics.append(metrics)
+        self.logger.info("Turn metrics: %s", metrics)
 
-                response_content = None
+        # 全部接收完成后将完整的中文回复和日文回复写入历史
+        if final_response_cn and final_response_jp:
+            now = time.time()
+            prompt_tokens, completion_tokens = metrics.get("prompt_tokens"), metrics.get("completion_tokens")
+            with self.history_lock:
+                # 本轮对话立即写入日志，编号只由对话日志分配
+                try:
+                    turn_id = self.history_journal.append_turn(text, final_response_cn, final_response_jp, now,
+                                                               interrupted, prompt_tokens, completion_tokens)
+                except Exception as e:
+                    self.logger.error(f"Error writing history journal: {e}")
+                    turn_id = self.history_journal.last_turn_id
 
-                tts_text_seq = self.jp_queue_tts.queue[0]['seq']
-                tts_text = self.jp_queue_tts.queue[0]['content']
-                self.jp_queue_tts.get()
+                record = TurnRecord(turn_id, now, text, final_response_cn, final_response_jp,
+                                    prompt_tokens, completion_tokens, interrupted)
+                self.turns.append(record)
 
-                if tts_text and self.use_tts:
+            if self.memory_index is not None:
+                self.memory_index.add(record)
 
-                    try:
-                        self.logger.info("Sending request to the tts API...")
+        self._request_summary()
 
-                        request_data = {"text": tts_text}
+    def _tts_thread(self):
+        """
+        TTS 分发线程：将待合成文本提交到合成线程池，
+        结果按 seq 顺序写入 sound_queue
+        """
 
-                        response = session.post(
-                            self.tts_api_url,
-                            data=json.dumps(request_data)
-                        )
+        with ThreadPoolExecutor(max_workers=self.tts_workers, thread_name_prefix="tts") as executor:
+            while self.is_running:
 
-                        response.raise_for_status()  # 检查请求是否成功
-                        result = response.json()
+                # 在途合成达到上限时先等待，待合成的文本留在有上限的 jp_queue_tts 中(背压)
+                if not self._acquire_tts_slot():
+                    break
 
-                        self.logger.info("Response received.")
+                # 阻塞等待待合成的日文文本
+                tts_item = self.jp_queue_tts.get()
+                if tts_item is _STOP:
+                    break
 
-                        # 检查返回的音频数据
-                        if "audio" in result:
-                            self.logger.info("Audio data received as Base64.")
+                tts_seq = tts_item['seq']
+                future = self._submit_tts(executor, tts_seq, tts_item['content'], tts_item['timeline'])
 
-                            # 解码 Base64 音频数据
-                            audio_base64 = result["audio"]
-                            audio_bytes = base64.b64decode(audio_base64)
+                with self._tts_pending_lock:
+                    self._tts_pending.append((tts_seq, future))
+                future.add_done_callback(self._flush_tts_results)
 
-                            self.logger.info("Audio decoded.")
+    def _acquire_tts_slot(self):
+        """
+        占用一个在途合成名额，结果放入 sound_queue 时归还
+        :return: 已关闭时返回 False
+        """
+        with self._tts_slots:
+            if 0 < self.tts_max_in_flight <= self._tts_in_flight and self.is_running:
+                self.tts_stalls += 1
+                start = time.perf_counter()
+                while 0 < self.tts_max_in_flight <= self._tts_in_flight and self.is_running:
+                    self._tts_slots.wait(0.5)
+                self.tts_stall_time += time.perf_counter() - start
+            if not self.is_running:
+                return False
+            self._tts_in_flight += 1
+            return True
 
-                            # 使用 soundfile 直接从内存中读取音频数据
-                            response_content = audio_bytes
-                        else:
-                            self.logger.info("Unexpected response format. No audio data found.")
-                    except requests.exceptions.RequestException as e:
-                        self.logger.info(f"Request failed: {e}")
-                    except Exception as e:
-                        self.logger.info(f"An error occurred: {e}")
+    def _release_tts_slot(self):
+        """归还一个在途合成名额"""
+        with self._tts_slots:
+            self._tts_in_flight -= 1
+            self._tts_slots.notify()
 
-                self.sound_queue.put({"seq": tts_text_seq, "content" : response_content})
+    def _submit_tts(self, executor, seq, tts_text, timeline):
+        """
+        提交一句语音合成
+        :param executor: 执行合成的线程池
+        :return: 完成时结果为音频数据、(首个片段, 后续片段队列) 或 None 的 Future
+        """
+        if not (tts_text and self.use_tts) or self._is_cancelled(timeline):
+            # 无需合成的条目(如回复结束标记)直接完成
+            return _completed_future(None)
+
+        cache_key = AudioCache.make_key(tts_text, self.tts_params)
+        audio = self.audio_cache.get(cache_key) if self.audio_cache else None
+        if audio is not None:
+            # 缓存命中，跳过 HTTP 请求
+            timeline.tts_start(seq)
+            timeline.tts_end(seq)
+            return _completed_future(audio)
+
+        if self.tts_streaming:
+            # 首个片段到达时即完成
+            future = Future()
+            task = executor.submit(self._timed_tts, timeline, seq,
+                                   self._synthesize_stream, tts_text, cache_key, future, timeline)
+            # 合成被跳过或异常结束时同样完成首个片段
+            task.add_done_callback(lambda _: future.done() or future.set_result(None))
+            return future
+
+        return executor.submit(self._timed_tts, timeline, seq, self._synthesize, tts_text, cache_key)
+
+    def _flush_tts_results(self, _future=None):
+        """将队首已完成的合成结果按 seq 顺序放入 sound_queue"""
+        with self._tts_pending_lock:
+            while self._tts_pending and self._tts_pending[0][1].done():
+                seq, future = self._tts_pending.popleft()
+                audio = future.result()
+                stream = None
+                if isinstance(audio, tuple):
+                    # 流式语音：首个片段 + 后续片段队列
+                    audio, stream = audio
+                self.sound_queue.put({"seq": seq, "content": audio, "stream": stream, "time": time.perf_counter()})
                 self.logger.info("TTS Response processed.")
+                self._release_tts_slot()
+
+    def _timed_tts(self, timeline, seq, synthesize, *args):
+        """在时间线上记录一句语音合成的开始和结束，所属轮次已被打断时跳过合成"""
+        if self._is_cancelled(timeline):
+            return None
+
+        timeline.tts_start(seq)
+        try:
+            return synthesize(*args)
+        finally:
+            timeline.tts_end(seq)
+
+    def _synthesize(self, tts_text, cache_key=None):
+        """
+        请求 TTS 服务合成一句日文语音
+        :param tts_text: 待合成的日文文本
+        :param cache_key: 音频缓存键，合成成功后写入缓存
+        :return: 音频数据，失败时返回 None
+        """
+        try:
+            self.logger.info("Sending request to the tts API...")
+
+            request_data = {"text": tts_text, **self.tts_params}
+
+            headers = {"Content-Type": "application/json"}
+            if self.tts_binary:
+                headers["Accept"] = "audio/wav, application/json"
+            response = self.http_pool.post(
+                self.tts_api_url,
+                data=json.dumps(request_data),
+                headers=headers
+            )
 
-            else :
-                time.sleep(0.1)
+            response.raise_for_status()  # 检查请求是否成功
+
+            self.logger.info("Response received.")
+
+            return self._decode_tts_response(response, cache_key)
+        except requests.exceptions.RequestException as e:
+            self.logger.info(f"Request failed: {e}")
+        except Exception as e:
+            self.logger.info(f"An error occurred: {e}")
+
+        return None
+
+    def _decode_tts_response(self, response, cache_key=None):
+        """
+        解析 TTS 响应中的音频数据(二进制或 JSON 中的 Base64)
+        :return: 音频数据，没有音频时返回 None
+        """
+        # 二进制音频直接使用，无需解码
+        if response.headers.get("Content-Type", "").startswith("audio/"):
+            audio_bytes = response.content
+            if self.audio_cache and cache_key:
+                self.audio_cache.put(cache_key, audio_bytes)
+            return audio_bytes
+
+        result = response.json()
+
+        # 检查返回的音频数据
+        if "audio" in result:
+            self.logger.info("Audio data received as Base64.")
+
+            # 解码 Base64 音频数据
+            audio_base64 = result["audio"]
+            audio_bytes = base64.b64decode(audio_base64)
+
+            self.logger.info("Audio decoded.")
+
+            if self.audio_cache and cache_key:
+                self.audio_cache.put(cache_key, audio_bytes)
+
+            return audio_bytes
+        else:
+            self.logger.info("Unexpected response format. No audio data found.")
+
+        return None
+
+    def _synthesize_stream(self, tts_text, cache_key, first_future, timeline=None):
+        """
+        以流式请求 TTS 服务，边接收边切分为可播放的片段
+        :param tts_text: 待合成的日文文本
+        :param cache_key: 音频缓存键，接收完成后写入完整音频
+        :param first_future: 首个片段到达时设置为 (首个片段, 后续片段队列)
+        :param timeline: 所属轮次的时间线，被打断时停止接收
+        """
+        # 后续片段的字节数计入回复队列的语音额度，游戏未及时取出时在此等待
+        budget = self.reply_queue if isinstance(self.reply_queue, ReplyQueue) else None
+        segments = AudioSegmentQueue(self.queue_maxsize, budget)
+        segmenter = WavStreamSegmenter()
+        try:
+            self.logger.info("Sending streaming request to the tts API...")
+
+            request_data = {"text": tts_text, "stream": True, **self.tts_params}
+            with self.http_pool.post(
+                self.tts_api_url,
+                data=json.dumps(request_data),
+                headers={"Content-Type": "application/json", "Accept": "audio/wav"},
+                stream=True
+            ) as response:
+                response.raise_for_status()
+
+                if not response.headers.get("Content-Type", "").startswith("audio/"):
+                    # 服务端不支持流式输出，按普通响应处理
+                    first_future.set_result(self._decode_tts_response(response, cache_key))
+                    return
+
+                for chunk in response.iter_content(chunk_size=4096):
+                    for segment in segmenter.feed(chunk):
+                        if not first_future.done():
+                            self.logger.info("First audio segment received.")
+                            first_future.set_result((segment, segments))
+                        elif not self._put_segment(segments, segment, timeline):
+                            # 游戏已不再播放本句，停止接收
+                            return
+
+            for segment in segmenter.flush():
+                if not first_future.done():
+                    first_future.set_result((segment, segments))
+                elif not self._put_segment(segments, segment, timeline):
+                    return
+
+            if self.audio_cache and cache_key:
+                self.audio_cache.put(cache_key, segmenter.full_audio())
+        except requests.exceptions.RequestException as e:
+            self.logger.info(f"Request failed: {e}")
+        except Exception as e:
+            self.logger.info(f"An error occurred: {e}")
+        finally:
+            if not first_future.done():
+                first_future.set_result(None)
+            segments.end()
+
+    def _put_segment(self, segments, segment, timeline):
+        """
+        放入一个流式语音片段，额度或片段数达到上限时等待
+        :return: 片段队列已被丢弃、所属轮次被打断或已关闭时返回 False
+        """
+        while not segments.discarded:
+            if self._is_cancelled(timeline) or not self.is_running:
+                segments.discard()
+                return False
+            try:
+                segments.put(segment, timeout=0.5)
+                return True
+            except Full:
+                continue
+        return False
 
     def _get_sequence_number(self):
         with self.sequence_lock:
@@ -451,45 +1274,115 @@ class VisualNovelAIAssistant:
             return seq
 
     def _monitor_queues(self):
+        queues = (self.jp_queue, self.cn_queue, self.sound_queue)
+        items = [None, None, None]
+
         while self.is_running:
-            # 检查是否有序列号在所有队列中都有数据
-            if not self.jp_queue.empty() and not self.cn_queue.empty() and not self.sound_queue.empty():
-                # 查看队列头部的序列号，但不取出
-                jp_seq = self.jp_queue.queue[0]['seq']
-                cn_seq = self.cn_queue.queue[0]['seq']
-                sound_seq = self.sound_queue.queue[0]['seq']
-
-                # 找到三个队列中最大的序列号
-                max_seq = max(jp_seq, cn_seq, sound_seq)
-
-                # 丢弃所有队列中小于最大序列号的数据
-                while not self.jp_queue.empty() and self.jp_queue.queue[0]['seq'] < max_seq:
-                    self.jp_queue.get()  # 丢弃不匹配的数据
-                while not self.cn_queue.empty() and self.cn_queue.queue[0]['seq'] < max_seq:
-                    self.cn_queue.get()  # 丢弃不匹配的数据
-                while not self.sound_queue.empty() and self.sound_queue.queue[0]['seq'] < max_seq:
-                    self.sound_queue.get()  # 丢弃不匹配的数据
-
-                # 再次检查是否有数据
-                if not self.jp_queue.empty() and not self.cn_queue.empty() and not self.sound_queue.empty():
-                    # 取出各队列中的数据
-                    jp_item = self.jp_queue.get()
-                    cn_item = self.cn_queue.get()
-                    sound_item = self.sound_queue.get()
-
-                    # 检查序列号是否匹配
-                    if jp_item['seq'] == cn_item['seq'] == sound_item['seq']:
-                        seq = jp_item['seq']
-                        # 组合成回复包
-                        reply_package = {
-                            'jp': jp_item['content'],
-                            'cn': cn_item['content'],
-                            'audio': sound_item['content']
-                        }
-                        self.reply_queue.put(reply_package)
-                    else:
-                        # 如果仍然不匹配，丢弃这些数据（理论上不会发生）
-                        pass
-            else:
-                # 队列为空时，休眠一段时间
-                time.sleep(0.1)
\ No newline at end of file
+            # 阻塞等待三个队列各自的下一条数据
+            for i, queue in enumerate(queues):
+                if items[i] is None:
+                    items[i] = queue.get()
+
+            if any(item is _STOP for item in items):
+                break
+
+            # 丢弃所有序列号小于最大序列号的数据,并重新等待对应队列
+            # (只有本线程从这三个队列取数据，阻塞的 get 之间无需加锁)
+            max_seq = max(item['seq'] for item in items)
+            for i, item in enumerate(items):
+                if item['seq'] < max_seq:
+                    self.join_drops += 1
+                    self.logger.warning("Unmatched item %d dropped while joining reply %d", item['seq'], max_seq)
+                    items[i] = None
+            if None in items:
+                continue
+
+            jp_item, cn_item, sound_item = items
+            items = [None, None, None]
+
+            self._emit_reply(jp_item['seq'], jp_item.get('timeline'), jp_item['content'], cn_item['content'],
+                             sound_item['content'], sound_item.get('stream'), jp_item.get('error'))
+
+            # 语音合成完成到回复包放入回复队列的耗时(含等待游戏取走的时间)，计入耗时统计
+            emit_ms = (time.perf_counter() - sound_item['time']) * 1000
+            if jp_item['content'] is not None:
+                self.stats.record_value("emit_after_tts", emit_ms)
+            self.logger.debug("Reply package %d emitted %.1f ms after TTS", jp_item['seq'], emit_ms)
+
+    def _emit_reply(self, seq, timeline, jp, cn, audio, audio_stream=None, error=None):
+        """
+        组合回复包并放入回复队列，jp 为 None 时表示本轮结束
+        :param audio_stream: 流式语音的后续片段队列
+        :param error: 本轮失败的原因(只出现在结束标记中)
+        """
+        motion, exp = self._emotions.pop(seq, (None, None))
+
+        # 被打断的轮次不再发出回复包
+        if self._is_cancelled(timeline):
+            self._drop_reply(seq, audio_stream)
+            return
+
+        # 组合成回复包
+        reply_package = {
+            'seq': seq,
+            'turn': timeline.turn_id if timeline is not None else None,
+            'jp': jp,
+            'cn': cn,
+            'audio': audio,
+            'audio_file': None,
+            'audio_stream': audio_stream, # 流式语音的后续片段队列，以 None 结束
+            'motion': motion, # 本句的 Live2D 动作，没有标注时为 None
+            'exp': exp, # 本句的 Live2D 表情，没有标注时为 None
+            'error': error
+        }
+
+        # 在后台线程中预先写好语音文件，游戏线程直接播放
+        if self.voice_store and audio:
+            try:
+                reply_package['audio_file'] = self.voice_store.write(audio)
+            except OSError as e:
+                self.logger.error(f"Error writing voice file: {e}")
+
+        # 检查是否被打断和放入回复队列在同一把锁内完成，cancel 撤回之后不会再放入；
+        # 队列满时在锁外等待，游戏线程调用 cancel 时不会被阻塞
+        while True:
+            with self._cancel_lock:
+                delivered = not self._is_cancelled(timeline)
+                if not delivered:
+                    break
+                try:
+                    self.reply_queue.put(reply_package, block=False)
+                except Full:
+                    pass
+                else:
+                    if timeline is not None and jp is not None:
+                        timeline.reply(seq)
+                    break
+            self._wait_reply_space(reply_package)
+
+        if not delivered:
+            self._drop_reply(seq, audio_stream)
+            return
+
+        if timeline is not None and jp is None:
+            # 回复结束标记：本轮完成
+            timeline.mark("turn_end")
+            self.stats.record(timeline)
+            if self.metrics_path and time.perf_counter() - self._last_metrics_dump >= self.metrics_interval:
+                self.dump_metrics()
+
+    def _drop_reply(self, seq, audio_stream):
+        """丢弃被打断轮次的回复包"""
+        self.logger.debug("Reply package %d of cancelled turn dropped", seq)
+        if audio_stream is not None:
+            audio_stream.discard()
+
+    def _wait_reply_space(self, reply_package, timeout=0.5):
+        """回复队列满时等待(不持有 _cancel_lock)"""
+        if isinstance(self.reply_queue, BoundedQueue):
+            self.reply_queue.wait_for_space(reply_package, timeout)
+        else:
+            time.sleep(0.05)
+
+
+from .session_manager import ManagedSession, SessionManager  # noqa: E402  依赖上面的 VisualNovelAIAssistant
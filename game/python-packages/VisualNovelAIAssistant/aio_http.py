@@ -0,0 +1,341 @@
+import asyncio
+import base64
+import json
+import socket
+import ssl
+import time
+from urllib.parse import unquote, urljoin, urlsplit
+
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_environ_proxies, select_proxy
+
+try:
+    import certifi
+except ImportError:
+    certifi = None
+
+_REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+
+class HTTPError(Exception):
+    """HTTP 状态码表示失败"""
+
+    def __init__(self, status, reason=""):
+        super().__init__(f"{status} {reason}".strip())
+        self.status = status
+
+
+class AsyncResponse:
+    """
+    HTTP/1.1 响应，响应体按需读取
+
+    响应体完整读取后连接归还连接池，提前关闭时连接直接断开
+    """
+
+    def __init__(self, client, key, reader, writer, status, reason, headers, timeout=None, method="GET"):
+        self.status = status
+        self.status_code = status
+        self.reason = reason
+        self.headers = headers
+        self.content = None
+        self.timeout = timeout # 每次读取的超时时间(秒)
+
+        self._client = client
+        self._key = key
+        self._reader = reader
+        self._writer = writer
+        self._done = False
+
+        self._chunked = "chunked" in headers.get("Transfer-Encoding", "").lower()
+        length = headers.get("Content-Length")
+        self._remaining = int(length) if length is not None and not self._chunked else None
+        if method == "HEAD" or status in (204, 304):
+            # 没有响应体
+            self._chunked = False
+            self._remaining = 0
+        self._keep_alive = (headers.get("Connection", "").lower() != "close"
+                            and (self._chunked or self._remaining is not None))
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            self.close()
+            raise HTTPError(self.status, self.reason)
+
+    async def iter_chunks(self):
+        """按到达顺序逐块返回响应体"""
+        while not self._done:
+            chunk = await self._read_chunk()
+            if chunk:
+                yield chunk
+
+    async def iter_lines(self):
+        """逐行返回响应体，行尾不含换行符"""
+        pending = b""
+        async for chunk in self.iter_chunks():
+            lines = (pending + chunk).split(b"\n")
+            pending = lines.pop()
+            for line in lines:
+                yield line.rstrip(b"\r")
+        if pending:
+            yield pending.rstrip(b"\r")
+
+    async def read(self):
+        """读取完整的响应体"""
+        if self.content is None:
+            self.content = b"".join([chunk async for chunk in self.iter_chunks()])
+        return self.content
+
+    def json(self):
+        return json.loads(self.content)
+
+    def close(self):
+        """响应体已读完时归还连接，否则断开连接"""
+        if self._writer is None:
+            return
+        if self._done and self._keep_alive:
+            self._client._release(self._key, self._reader, self._writer)
+        else:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    async def _read_chunk(self):
+        reader = self._reader
+        if self._chunked:
+            size_line = await self._wait(reader.readline())
+            if not size_line:
+                raise ConnectionError("Connection closed in chunked body")
+            size = int(size_line.split(b";", 1)[0], 16)
+            if size == 0:
+                # 跳过 trailer
+                while (await self._wait(reader.readline())).strip():
+                    pass
+                self._done = True
+                return b""
+            data = await self._wait(reader.readexactly(size + 2))
+            return data[:-2]
+
+        if self._remaining is not None:
+            if self._remaining == 0:
+                self._done = True
+                return b""
+            data = await self._wait(reader.read(min(self._remaining, 65536)))
+            if not data:
+                raise ConnectionError("Connection closed before end of body")
+            self._remaining -= len(data)
+            self._done = self._remaining == 0
+            return data
+
+        # 没有长度信息，读取到连接关闭
+        data = await self._wait(reader.read(65536))
+        self._done = not data
+        return data
+
+    def _wait(self, awaitable):
+        return asyncio.wait_for(awaitable, self.timeout)
+
+
+class AsyncHTTPClient:
+    """
+    基于 asyncio 流的最小 HTTP/1.1 客户端，按 (协议, 主机, 端口) 复用长连接
+
+    与 requests 保持一致：HTTPS 使用 certifi 的 CA 证书(已安装时)，
+    遵循 HTTP_PROXY / HTTPS_PROXY / NO_PROXY 环境变量(只支持 http:// 代理，HTTPS 经 CONNECT 隧道)，
+    并跟随重定向。不支持 SOCKS 代理和 HTTPS 代理地址，遇到时抛出 ValueError，需改用 engine="threads"
+    """
+
+    def __init__(self, max_idle=8):
+        """
+        :param max_idle: 每个主机保留的最大空闲连接数
+        """
+        self.max_idle = max_idle
+        self.max_redirects = 5
+        self.trust_env = True # 是否读取代理环境变量
+        self.connections_created = 0
+        self.requests = 0
+        self.last_used = time.monotonic() # 最近一次发出请求的时刻，用于判断连接是否空闲
+        self._idle = {} # (协议, 主机, 端口) -> [(reader, writer)]
+        self._proxies = {} # (协议, 主机, 端口) -> 代理地址或 None
+        self._ssl = None
+
+    async def request(self, method, url, headers=None, data=None, timeout=None):
+        """
+        发送请求并读取响应头，跟随重定向
+        :param data: 请求体(bytes 或 str)
+        :param timeout: 建立连接、等待响应头以及之后每次读取响应体的超时时间(秒)
+        :return: AsyncResponse
+        """
+        headers = dict(headers or {})
+        for _ in range(self.max_redirects + 1):
+            response = await self._send(method, url, headers, data, timeout)
+            location = response.headers.get("Location")
+            if response.status not in _REDIRECT_CODES or not location:
+                return response
+
+            # 与 requests 一致：303 以及 POST 的 301/302 改为 GET，跨主机时不再发送认证信息
+            await response.read()
+            response.close()
+            new_url = urljoin(url, location)
+            if (response.status == 303 and method != "HEAD") or (response.status in (301, 302) and method == "POST"):
+                method, data = "GET", None
+            if urlsplit(new_url).hostname != urlsplit(url).hostname:
+                headers = {name: value for name, value in headers.items() if name.lower() != "authorization"}
+            url = new_url
+
+        raise HTTPError(response.status, f"Exceeded {self.max_redirects} redirects")
+
+    async def _send(self, method, url, headers, data, timeout):
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            # 与 requests 一致，配置错误不当作网络错误(不会重试)
+            raise ValueError(f"Invalid URL: {url!r}")
+        secure = parts.scheme == "https"
+        port = parts.port or (443 if secure else 80)
+        key = (parts.scheme, parts.hostname, port)
+        proxy = self._select_proxy(key, url)
+
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        data = data or b""
+
+        path = (parts.path or "/") + ("?" + parts.query if parts.query else "")
+        request_headers = {}
+        if proxy is not None and not secure:
+            # 经 HTTP 代理转发：请求行使用完整地址
+            path = url.split("#", 1)[0]
+            request_headers.update(self._proxy_headers(proxy))
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {parts.netloc}", f"Content-Length: {len(data)}"]
+        lines.extend(f"{name}: {value}" for name, value in {**request_headers, **headers}.items())
+        payload = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + data
+
+        self.requests += 1
+        self.last_used = time.monotonic()
+        while True:
+            connection = self._acquire(key)
+            reused = connection is not None
+            if not reused:
+                connection = await asyncio.wait_for(self._connect(parts.hostname, port, secure, proxy, timeout),
+                                                    timeout)
+            reader, writer = connection
+
+            try:
+                writer.write(payload)
+                await writer.drain()
+                status, reason, response_headers = await asyncio.wait_for(self._read_head(reader), timeout)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+                if reused:
+                    # 空闲连接已被服务端关闭，换新连接重试一次
+                    continue
+                raise
+            except BaseException:
+                writer.close()
+                raise
+
+            return AsyncResponse(self, key, reader, writer, status, reason, response_headers, timeout, method)
+
+    async def close(self):
+        """关闭所有空闲连接"""
+        for connections in self._idle.values():
+            for _, writer in connections:
+                writer.close()
+        self._idle.clear()
+
+    def _acquire(self, key):
+        connections = self._idle.get(key)
+        while connections:
+            reader, writer = connections.pop()
+            if not reader.at_eof() and not writer.is_closing():
+                return reader, writer
+            writer.close()
+        return None
+
+    def _release(self, key, reader, writer):
+        connections = self._idle.setdefault(key, [])
+        if len(connections) < self.max_idle and not reader.at_eof():
+            connections.append((reader, writer))
+        else:
+            writer.close()
+
+    def _select_proxy(self, key, url):
+        """按环境变量选择代理，结果按主机缓存"""
+        if not self.trust_env:
+            return None
+        if key not in self._proxies:
+            proxy = select_proxy(url, get_environ_proxies(url))
+            if proxy is not None:
+                proxy_parts = urlsplit(proxy if "://" in proxy else "http://" + proxy)
+                if proxy_parts.scheme != "http" or not proxy_parts.hostname:
+                    raise ValueError(f"Proxy {proxy!r} is not supported by the asyncio engine, use engine='threads'")
+                proxy = proxy_parts
+            self._proxies[key] = proxy
+        return self._proxies[key]
+
+    @staticmethod
+    def _proxy_headers(proxy):
+        if proxy.username is None:
+            return {}
+        credentials = f"{unquote(proxy.username)}:{unquote(proxy.password or '')}"
+        return {"Proxy-Authorization": "Basic " + base64.b64encode(credentials.encode("latin-1")).decode("ascii")}
+
+    def _ssl_context(self):
+        if self._ssl is None:
+            # 与 requests 一致使用 certifi 的 CA 证书，部分系统自带的证书库不完整
+            self._ssl = ssl.create_default_context(cafile=certifi.where() if certifi is not None else None)
+        return self._ssl
+
+    async def _connect(self, host, port, secure, proxy=None, timeout=None):
+        if proxy is None:
+            connection = await asyncio.open_connection(host, port, ssl=self._ssl_context() if secure else None)
+        elif not secure:
+            connection = await asyncio.open_connection(proxy.hostname, proxy.port or 80)
+        else:
+            # 经 CONNECT 隧道建立 TLS 连接(Python 3.9 的流不支持 start_tls，隧道在线程池中建立)
+            loop = asyncio.get_running_loop()
+            sock = await loop.run_in_executor(None, self._open_tunnel, proxy, host, port, timeout)
+            try:
+                connection = await asyncio.open_connection(sock=sock, ssl=self._ssl_context(), server_hostname=host)
+            except BaseException:
+                sock.close()
+                raise
+        self.connections_created += 1
+        return connection
+
+    def _open_tunnel(self, proxy, host, port, timeout):
+        sock = socket.create_connection((proxy.hostname, proxy.port or 80), timeout)
+        try:
+            lines = [f"CONNECT {host}:{port} HTTP/1.1", f"Host: {host}:{port}"]
+            lines.extend(f"{name}: {value}" for name, value in self._proxy_headers(proxy).items())
+            sock.sendall(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+            head = b""
+            while b"\r\n\r\n" not in head:
+                data = sock.recv(4096)
+                if not data:
+                    raise ConnectionError("Proxy closed the connection during CONNECT")
+                head += data
+            status_line = head.split(b"\r\n", 1)[0].decode("latin-1")
+            status = status_line.split(" ", 2)
+            if len(status) < 2 or status[1] != "200":
+                raise ConnectionError(f"Proxy CONNECT failed: {status_line}")
+            sock.settimeout(None)
+            sock.setblocking(False)
+            return sock
+        except BaseException:
+            sock.close()
+            raise
+
+    @staticmethod
+    async def _read_head(reader):
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError("Connection closed before response")
+        _, status, *reason = status_line.decode("latin-1").rstrip("\r\n").split(" ", 2)
+
+        headers = CaseInsensitiveDict()
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip()] = value.strip()
+
+        return int(status), reason[0] if reason else "", headers
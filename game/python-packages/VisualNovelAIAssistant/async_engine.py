@@ -0,0 +1,495 @@
+import asyncio
+import json
+import threading
+import time
+
+from .aio_http import AsyncHTTPClient, HTTPError
+from .audio_cache import AudioCache
+from .resilience import FirstTokenTimeout, backoff_delay, is_retryable
+from .turn_stream import TurnStream
+
+_STOP = object()
+
+
+class AsyncPipelineEngine:
+    """
+    asyncio 流水线：在一个后台线程的事件循环中运行 LLM 流式请求、句子解析、
+    并发语音合成和回复组装，代替对话/TTS/监控三个线程
+
+    对游戏一侧的接口不变：输入仍通过 start_fetching 提交，回复包仍放入 reply_queue
+    """
+
+    def __init__(self, assistant):
+        """
+        :param assistant: 所属的 VisualNovelAIAssistant，配置和状态都从其读取
+        """
+        self.assistant = assistant
+        self.llm_timeout = 40 # 连接 LLM 及之后每次读取的超时时间(秒)
+        self.tts_timeout = 30 # 连接 TTS 及之后每次读取的超时时间(秒)
+
+        self.loop = asyncio.new_event_loop()
+        self.http = None
+        self._thread = threading.Thread(target=self._run, name="aio-engine", daemon=True)
+        self._ready = threading.Event()
+
+        # 以下对象只在事件循环线程中访问
+        self._turns = None       # 待处理的输入
+        self._assembly = None    # 按 seq 顺序等待组装的句子
+        self._tts_slots = None   # 限制并发合成数
+        self._active = None      # 正在接收回复的轮次任务
+        self._active_timeline = None
+        self._tts_tasks = {}     # 合成任务 -> 所属轮次的时间线
+        self._tts_in_flight_cond = None # 在途合成数达到 tts_max_in_flight 时等待
+        self.tts_in_flight = 0   # 已创建但尚未组装成回复包的合成任务数
+        self.tts_stalls = 0      # 因在途合成达到上限而等待的次数
+        self.tts_stall_time = 0.0
+        self.assembly_stalls = 0 # 组装队列满而等待的次数
+        self.assembly_stall_time = 0.0
+
+    def start(self):
+        """启动事件循环线程"""
+        self._thread.start()
+        self._ready.wait()
+
+    def submit(self, item):
+        """提交一轮输入(可在任意线程调用)"""
+        self.loop.call_soon_threadsafe(self._turns.put_nowait, item)
+
+    def cancel_active(self):
+        """取消已被打断轮次的流式请求和语音合成(可在任意线程调用)"""
+        self.loop.call_soon_threadsafe(self._cancel_turns)
+
+    def summarize(self):
+        """在线程池中进行后台总结(可在任意线程调用)"""
+        try:
+            asyncio.run_coroutine_threadsafe(self._summarize(), self.loop)
+        except RuntimeError:
+            # 事件循环已停止
+            self._clear_summary_pending()
+
+    def warm(self, urls, timeout=5):
+        """预先与各服务建立连接并放入连接池(阻塞到完成，可在任意线程调用)"""
+        future = asyncio.run_coroutine_threadsafe(self._warm(urls, timeout), self.loop)
+        try:
+            future.result(timeout * len(urls) + 1)
+        except Exception as e:
+            self.assistant.logger.info("Warming connections failed: %s", e)
+
+    def last_used(self):
+        """事件循环中的 HTTP 客户端最近一次发出请求的时刻(time.monotonic)"""
+        http = self.http
+        return http.last_used if http is not None else 0.0
+
+    def connection_stats(self):
+        http = self.http
+        if http is None:
+            return {}
+        return {"connections": http.connections_created, "requests": http.requests,
+                "reused": max(0, http.requests - http.connections_created)}
+
+    def queue_stats(self):
+        assembly = self._assembly
+        return {"assembly": {"size": assembly.qsize() if assembly is not None else 0,
+                             "maxsize": self.assistant.queue_maxsize,
+                             "stalls": self.assembly_stalls,
+                             "stall_ms": round(self.assembly_stall_time * 1000, 1)},
+                "tts_in_flight": {"size": self.tts_in_flight,
+                                  "maxsize": self.assistant.tts_max_in_flight,
+                                  "stalls": self.tts_stalls,
+                                  "stall_ms": round(self.tts_stall_time * 1000, 1)}}
+
+    def close(self, timeout=5.0):
+        """处理完已提交的输入后停止事件循环"""
+        if self._thread.is_alive():
+            self.loop.call_soon_threadsafe(self._turns.put_nowait, _STOP)
+            if self._thread is not threading.current_thread():
+                self._thread.join(timeout)
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self._main())
+        finally:
+            self.loop.close()
+
+    async def _main(self):
+        assistant = self.assistant
+        self._turns = asyncio.Queue()
+        # 组装队列有容量上限：回复队列阻塞时不再继续读取流和发起合成
+        self._assembly = asyncio.Queue(assistant.queue_maxsize)
+        self._tts_slots = asyncio.Semaphore(assistant.tts_workers)
+        self._tts_in_flight_cond = asyncio.Condition()
+        self.http = AsyncHTTPClient(max_idle=max(8, assistant.tts_workers))
+        assembler = self.loop.create_task(self._assemble())
+        self._ready.set()
+
+        if assistant.tts_streaming:
+            assistant.logger.info("Streaming TTS is not supported by the asyncio engine, full audio is used")
+
+        try:
+            while True:
+                item = await self._turns.get()
+                if item is _STOP or not assistant.is_running:
+                    break
+
+                # 一次只接收一轮回复；语音合成和组装与下一轮的请求并行
+                self._active = self.loop.create_task(self._run_turn(item))
+                self._active_timeline = item['timeline']
+                with assistant._cancel_lock:
+                    assistant._active_timeline = self._active_timeline
+                try:
+                    await self._active
+                except asyncio.CancelledError:
+                    # 回复接收完成后才被打断，本轮的回复包由组装时丢弃
+                    pass
+                except Exception as e:
+                    assistant.logger.error("Unexpected error in turn: %s", e)
+                finally:
+                    with assistant._cancel_lock:
+                        assistant._active_timeline = None
+                    self._active = self._active_timeline = None
+        finally:
+            await self._assembly.put(_STOP)
+            await assembler
+            await self.http.close()
+            await self.loop.shutdown_default_executor()
+
+    async def _summarize(self):
+        assistant = self.assistant
+        try:
+            await self.loop.run_in_executor(None, assistant._run_summary)
+        except Exception as e:
+            assistant.logger.error("Error in background summary: %s", e)
+            self._clear_summary_pending()
+
+    def _clear_summary_pending(self):
+        with self.assistant.history_lock:
+            self.assistant._summary_pending = False
+
+    async def _warm(self, urls, timeout):
+        for url in urls:
+            try:
+                response = await self.http.request("HEAD", url, timeout=timeout)
+                await response.read()
+                response.close()
+            except (OSError, asyncio.TimeoutError, ValueError) as e:
+                self.assistant.logger.info("Warming connection to %s failed: %s", url, e)
+
+    def _cancel_turns(self):
+        assistant = self.assistant
+        if self._active is not None and assistant._is_cancelled(self._active_timeline):
+            self._active.cancel()
+        for task, timeline in list(self._tts_tasks.items()):
+            if assistant._is_cancelled(timeline):
+                task.cancel()
+
+    async def _run_turn(self, item):
+        """请求 LLM 并解析流式回复，每解析出一句就开始合成语音"""
+        assistant = self.assistant
+        text = item['text']
+        timeline = item['timeline']
+
+        # 已被打断的输入不再请求
+        if assistant._is_cancelled(timeline):
+            return
+
+        error = None
+        try:
+            await self._receive_turn(text, timeline)
+        except asyncio.CancelledError:
+            if not assistant._is_cancelled(timeline):
+                raise
+        except Exception as e:
+            # 任何错误都要发出结束标记，游戏不会一直等待
+            assistant.logger.error("Error occurred while fetching response: %s", str(e))
+            error = str(e)
+
+        # 回复结束标记
+        await self._put_assembly((assistant._get_sequence_number(), timeline, None, None, None, error))
+
+    async def _receive_turn(self, text, timeline):
+        """
+        接收并解析一轮流式回复，写入历史
+        :raise: 请求失败时抛出，已解析的部分照常写入历史
+        """
+        assistant = self.assistant
+        if not assistant.wait_history(0):
+            # 历史仍在后台加载
+            await self.loop.run_in_executor(None, assistant.wait_history)
+
+        # 检索和组装会获取 history_lock 并可能等待索引建立，不在事件循环线程中执行
+        request_data = await self.loop.run_in_executor(None, assistant._build_request_data, text, timeline)
+        assistant.logger.info("Sending request to LLM API, Request data: %s", request_data)
+
+        turn = TurnStream(assistant, text, timeline)
+        pending = {} # seq -> (日文, 合成任务)，等待中文翻译
+        stream = None
+        error = None
+        try:
+            timeline.mark("request_sent")
+            stream, stream_info = await self._open_stream(request_data)
+            turn.metrics.update(stream_info)
+            assistant.logger.info("Response received from LLM API")
+
+            async for line in stream.iter_lines():
+                try:
+                    events = turn.feed_line(line)
+                except ValueError as e:
+                    assistant.logger.warning("Malformed stream data skipped: %s", str(e))
+                    continue
+
+                for tag, seq, sentence in events:
+                    await self._on_sentence(tag, seq, sentence, timeline, pending)
+                if turn.done or not assistant.is_running:
+                    break
+        except asyncio.CancelledError:
+            # 被打断：保留已解析的部分，照常结束本轮
+            if not assistant._is_cancelled(timeline):
+                raise
+        except Exception as e:
+            # 保留已收到的部分，仍然发出结束标记
+            error = e
+        finally:
+            if stream is not None:
+                stream.close()
+
+        for tag, seq, sentence in turn.finish():
+            await self._on_sentence(tag, seq, sentence, timeline, pending)
+
+        # 写入历史涉及文件同步，放到线程池中执行
+        await self.loop.run_in_executor(None, assistant._finish_turn, turn)
+
+        if error is not None:
+            raise error
+
+    async def _put_assembly(self, entry):
+        """放入组装队列，队列满时等待并计数"""
+        if self._assembly.full():
+            self.assembly_stalls += 1
+            start = time.perf_counter()
+            await self._assembly.put(entry)
+            self.assembly_stall_time += time.perf_counter() - start
+        else:
+            self._assembly.put_nowait(entry)
+
+    async def _open_stream(self, request_data):
+        """
+        发出流式请求并等到首个数据块，失败时带退避重试(有备用接口时轮流使用)
+        :return: (胜出的 _OpenStream, 本轮请求信息)
+        """
+        assistant = self.assistant
+        endpoints = assistant._llm_endpoints()
+        hedging = assistant.hedge_delay is not None and len(endpoints) > 1
+        error = None
+
+        for attempt in range(assistant.llm_max_retries + 1):
+            if attempt:
+                delay = backoff_delay(attempt - 1, assistant.retry_backoff, assistant.retry_backoff_max)
+                assistant.logger.info("Retrying LLM request in %.2f s (attempt %d)", delay, attempt + 1)
+                await asyncio.sleep(delay)
+
+            primary = endpoints[attempt % len(endpoints)]
+            hedge = endpoints[(attempt + 1) % len(endpoints)] if hedging else None
+            stream, hedged, error = await self._race(request_data, primary, hedge)
+            if stream is not None:
+                return stream, {"endpoint": stream.endpoint.name, "attempts": attempt + 1, "hedged": hedged}
+            if not is_retryable(error):
+                break
+
+        raise error
+
+    async def _race(self, request_data, primary, hedge=None):
+        """
+        带首 token 时限的一次请求，可选向备用接口对冲，先返回数据的请求胜出
+        :return: (胜出的 _OpenStream 或 None, 是否对冲, 最后一个错误)
+        """
+        assistant = self.assistant
+        loop = self.loop
+        tasks = {loop.create_task(self._attempt(primary, request_data))}
+        deadline = loop.time() + assistant.first_token_timeout
+        hedge_at = loop.time() + assistant.hedge_delay if hedge is not None else None
+        hedged = False
+        winner = None
+        error = None
+
+        try:
+            while tasks and winner is None:
+                wait_until = deadline if hedge_at is None else min(deadline, hedge_at)
+                done, _ = await asyncio.wait(tasks, timeout=max(0.0, wait_until - loop.time()),
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if hedge_at is not None and loop.time() >= hedge_at:
+                        assistant.logger.info("Hedging LLM request to %s", hedge.name)
+                        tasks.add(loop.create_task(self._attempt(hedge, request_data)))
+                        hedge_at = None
+                        hedged = True
+                        continue
+                    error = FirstTokenTimeout(f"No data within {assistant.first_token_timeout:.1f} s")
+                    break
+
+                for task in done:
+                    tasks.discard(task)
+                    try:
+                        stream = task.result()
+                    except Exception as e:
+                        error = e
+                        assistant.logger.warning("LLM request failed: %s", e)
+                        continue
+                    if winner is None:
+                        winner = stream
+                    else:
+                        stream.close()
+
+                if winner is None and hedge_at is not None and is_retryable(error):
+                    # 主接口提前失败，立即改用备用接口
+                    assistant.logger.info("Hedging LLM request to %s", hedge.name)
+                    tasks.add(loop.create_task(self._attempt(hedge, request_data)))
+                    hedge_at = None
+                    hedged = True
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        return winner, hedged, error
+
+    async def _attempt(self, endpoint, request_data):
+        """发出一次流式请求，读到首个数据块为止"""
+        response = await self.http.request(
+            "POST",
+            endpoint.url,
+            headers=endpoint.headers(),
+            data=endpoint.body(request_data),
+            timeout=self.llm_timeout
+        )
+        try:
+            response.raise_for_status()
+            lines = response.iter_lines()
+            buffered = []
+            async for line in lines:
+                buffered.append(line)
+                if line.startswith(b"data: "):
+                    break
+            return _OpenStream(endpoint, response, buffered, lines)
+        except BaseException:
+            response.close()
+            raise
+
+    async def _on_sentence(self, tag, seq, sentence, timeline, pending):
+        if tag == "jp":
+            # 在途合成达到上限时先等待，暂停读取流(背压)
+            await self._acquire_tts_slot()
+            task = self.loop.create_task(self._synthesize(timeline, seq, sentence))
+            self._tts_tasks[task] = timeline
+            task.add_done_callback(self._tts_tasks.pop)
+            pending[seq] = (sentence, task)
+        else:
+            jp, task = pending.pop(seq)
+            await self._put_assembly((seq, timeline, jp, sentence, task, None))
+
+    async def _acquire_tts_slot(self):
+        """占用一个在途合成名额，组装成回复包后归还"""
+        assistant = self.assistant
+        async with self._tts_in_flight_cond:
+            if 0 < assistant.tts_max_in_flight <= self.tts_in_flight:
+                self.tts_stalls += 1
+                start = time.perf_counter()
+                await self._tts_in_flight_cond.wait_for(
+                    lambda: not 0 < assistant.tts_max_in_flight <= self.tts_in_flight)
+                self.tts_stall_time += time.perf_counter() - start
+            self.tts_in_flight += 1
+
+    async def _release_tts_slot(self):
+        async with self._tts_in_flight_cond:
+            self.tts_in_flight -= 1
+            self._tts_in_flight_cond.notify()
+
+    async def _synthesize(self, timeline, seq, text):
+        """
+        合成一句日文语音，并发数不超过 tts_workers
+        :return: 音频数据，失败或无需合成时返回 None
+        """
+        assistant = self.assistant
+        if not (text and assistant.use_tts):
+            return None
+
+        cache_key = AudioCache.make_key(text, assistant.tts_params)
+        if assistant.audio_cache:
+            audio = await self.loop.run_in_executor(None, assistant.audio_cache.get, cache_key)
+            if audio is not None:
+                # 缓存命中，跳过 HTTP 请求
+                timeline.tts_start(seq)
+                timeline.tts_end(seq)
+                return audio
+
+        async with self._tts_slots:
+            if assistant._is_cancelled(timeline):
+                return None
+
+            timeline.tts_start(seq)
+            response = None
+            try:
+                headers = {"Content-Type": "application/json"}
+                if assistant.tts_binary:
+                    headers["Accept"] = "audio/wav, application/json"
+                response = await self.http.request(
+                    "POST",
+                    assistant.tts_api_url,
+                    headers=headers,
+                    data=json.dumps({"text": text, **assistant.tts_params}),
+                    timeout=self.tts_timeout
+                )
+                response.raise_for_status()
+                await response.read()
+                response.close()
+
+                # Base64 解码和写缓存放到线程池中执行
+                return await self.loop.run_in_executor(None, assistant._decode_tts_response, response, cache_key)
+            except (OSError, asyncio.TimeoutError, HTTPError, ValueError) as e:
+                assistant.logger.info(f"Request failed: {e}")
+                return None
+            finally:
+                if response is not None:
+                    response.close()
+                timeline.tts_end(seq)
+
+    async def _assemble(self):
+        """按 seq 顺序等待语音合成完成，组装回复包"""
+        assistant = self.assistant
+        while True:
+            entry = await self._assembly.get()
+            if entry is _STOP:
+                break
+
+            seq, timeline, jp, cn, task, error = entry
+            audio = None
+            if task is not None:
+                try:
+                    audio = await task
+                except asyncio.CancelledError:
+                    pass
+                except Exception as e:
+                    assistant.logger.info(f"An error occurred: {e}")
+
+            # 写语音文件和导出统计涉及文件操作，放到线程池中执行
+            await self.loop.run_in_executor(None, assistant._emit_reply, seq, timeline, jp, cn, audio, None, error)
+            if task is not None:
+                await self._release_tts_slot()
+
+
+class _OpenStream:
+    """已收到首个数据块的流式响应"""
+
+    def __init__(self, endpoint, response, buffered, lines):
+        self.endpoint = endpoint
+        self.response = response
+        self._buffered = buffered
+        self._lines = lines
+
+    async def iter_lines(self):
+        for line in self._buffered:
+            yield line
+        async for line in self._lines:
+            yield line
+
+    def close(self):
+        self.response.close()
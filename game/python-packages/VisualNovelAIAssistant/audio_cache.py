@@ -0,0 +1,185 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+
+class AudioCache:
+    """
+    以内容寻址的 TTS 音频缓存
+
+    键由文本和语音参数计算得到，内存层与磁盘层均按 LRU 淘汰，
+    磁盘层在重启后仍然有效
+    """
+
+    def __init__(self, cache_dir=None, max_memory_bytes=32 * 1024 * 1024,
+                 max_disk_bytes=256 * 1024 * 1024):
+        """
+        :param cache_dir: 磁盘缓存目录，应使用绝对路径(如 Ren'Py 的 config.savedir 下)，为 None 时只使用内存缓存
+        :param max_memory_bytes: 内存层容量上限(字节)
+        :param max_disk_bytes: 磁盘层容量上限(字节)
+        """
+        self.cache_dir = cache_dir
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+
+        # 锁只保护索引和统计，文件读写、目录扫描和删除都在锁外进行
+        self._memory = OrderedDict()  # key -> bytes
+        self._memory_bytes = 0
+        self._disk = None             # key -> 文件大小，首次访问时从目录加载
+        self._disk_bytes = 0
+        self._writing = set()         # 正在写入磁盘的键
+        self._lock = threading.Lock()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(text, params=None):
+        """
+        计算缓存键
+        :param text: 合成文本
+        :param params: 影响合成结果的语音参数
+        """
+        payload = json.dumps({"text": text, "params": params or {}}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """
+        查询缓存
+        :return: 音频数据，未命中时返回 None
+        """
+        path = self._disk_path(key)
+        disk = self._load_disk_index() if path else None
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return data
+            if disk is None or key not in disk:
+                self.misses += 1
+                return None
+
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            # 文件已被删除(可能刚被淘汰)
+            with self._lock:
+                self._disk_bytes -= disk.pop(key, 0)
+                self.misses += 1
+            return None
+
+        with self._lock:
+            if key in disk:
+                disk.move_to_end(key)
+            self._put_memory(key, data)
+            self.disk_hits += 1
+        return data
+
+    def put(self, key, data):
+        """
+        写入缓存
+        :param key: 缓存键
+        :param data: 音频数据
+        """
+        if not data:
+            return
+
+        with self._lock:
+            self._put_memory(key, data)
+
+        path = self._disk_path(key)
+        if not path or len(data) > self.max_disk_bytes:
+            return
+
+        disk = self._load_disk_index()
+        with self._lock:
+            if key in disk or key in self._writing:
+                return
+            self._writing.add(key)
+
+        try:
+            # 先写临时文件再替换，避免崩溃时留下不完整的音频，读取方也不会读到写了一半的文件
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            with self._lock:
+                self._writing.discard(key)
+            return
+
+        evicted = []
+        with self._lock:
+            self._writing.discard(key)
+            disk[key] = len(data)
+            self._disk_bytes += len(data)
+            while self._disk_bytes > self.max_disk_bytes and disk:
+                old_key, size = disk.popitem(last=False)
+                self._disk_bytes -= size
+                evicted.append(old_key)
+
+        for old_key in evicted:
+            try:
+                os.remove(self._disk_path(old_key))
+            except OSError:
+                pass
+
+    def stats(self):
+        """返回缓存命中统计"""
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                "memory_bytes": self._memory_bytes,
+                "disk_bytes": self._disk_bytes,
+            }
+
+    def _put_memory(self, key, data):
+        if len(data) > self.max_memory_bytes:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= len(old)
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _disk_path(self, key):
+        if not self.cache_dir:
+            return None
+        return os.path.join(self.cache_dir, key + ".wav")
+
+    def _load_disk_index(self):
+        """按修改时间从旧到新加载磁盘缓存索引，目录扫描在锁外进行"""
+        if self._disk is not None:
+            return self._disk
+
+        entries = []
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            for entry in os.scandir(self.cache_dir):
+                if entry.is_file() and entry.name.endswith(".wav"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, entry.name[:-4], stat.st_size))
+        except OSError:
+            pass
+
+        with self._lock:
+            if self._disk is None:
+                disk = OrderedDict()
+                for _, key, size in sorted(entries):
+                    disk[key] = size
+                    self._disk_bytes += size
+                self._disk = disk
+            return self._disk
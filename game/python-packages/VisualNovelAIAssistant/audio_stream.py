@@ -0,0 +1,118 @@
+import struct
+
+
+class WavStreamSegmenter:
+    """
+    将分块到达的 WAV 音频切分为可独立播放的短片段
+
+    第一个片段较短以尽快开始播放，之后的片段较长以减少衔接次数。
+    每个片段都带有完整的 WAV 头；非 WAV 数据不切分，结束时整体输出
+    """
+
+    def __init__(self, first_seconds=0.3, seconds=1.0):
+        """
+        :param first_seconds: 第一个片段的时长(秒)
+        :param seconds: 后续片段的时长(秒)
+        """
+        self.first_seconds = first_seconds
+        self.seconds = seconds
+
+        self._header = b""     # 尚未解析完的头部数据
+        self._fmt = None       # fmt 块内容
+        self._passthrough = False
+        self._pending = bytearray()  # 尚未输出的 PCM 数据
+        self._pcm = []               # 全部 PCM 数据，用于拼接完整音频
+        self._segments = 0
+
+    def feed(self, data):
+        """
+        输入一块音频数据
+        :return: 本次可以输出的片段列表
+        """
+        if self._passthrough:
+            self._pcm.append(data)
+            return []
+
+        if self._fmt is None or self._header:
+            data = self._parse_header(self._header + data)
+            if data is None:
+                return []
+
+        self._pcm.append(data)
+        self._pending += data
+        return self._take_segments(final=False)
+
+    def flush(self):
+        """音频结束，输出剩余的片段"""
+        if self._passthrough or self._fmt is None:
+            audio = self._header + b"".join(self._pcm)
+            self._header = b""
+            return [audio] if audio else []
+        return self._take_segments(final=True)
+
+    def full_audio(self):
+        """返回完整的音频数据"""
+        if self._passthrough or self._fmt is None:
+            return self._header + b"".join(self._pcm)
+        return self._wav(b"".join(self._pcm))
+
+    def _take_segments(self, final):
+        byte_rate, block_align = struct.unpack("<8xIH", self._fmt[:14])
+        block_align = max(block_align, 1)
+
+        segments = []
+        while self._pending:
+            seconds = self.first_seconds if self._segments == 0 else self.seconds
+            size = max(block_align, int(byte_rate * seconds) // block_align * block_align)
+            if len(self._pending) < size:
+                if not final:
+                    break
+                size = len(self._pending)
+            segments.append(self._wav(bytes(self._pending[:size])))
+            del self._pending[:size]
+            self._segments += 1
+        return segments
+
+    def _parse_header(self, data):
+        """
+        解析 RIFF 头，直到 data 块开始
+        :return: data 块之后的 PCM 数据，头部尚不完整时返回 None
+        """
+        if len(data) < 12:
+            self._header = data
+            return None
+        if data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+            self._passthrough = True
+            self._pcm.append(data)
+            self._header = b""
+            return None
+
+        offset = 12
+        while True:
+            if len(data) < offset + 8:
+                self._header = data
+                return None
+            chunk_id = data[offset:offset + 4]
+            chunk_size = struct.unpack("<I", data[offset + 4:offset + 8])[0]
+            body = offset + 8
+            if chunk_id == b"data":
+                if self._fmt is None:
+                    self._passthrough = True
+                    self._pcm.append(data)
+                    self._header = b""
+                    return None
+                # 流式 WAV 的 data 长度通常未知，忽略该长度
+                self._header = b""
+                return data[body:]
+            if len(data) < body + chunk_size:
+                self._header = data
+                return None
+            if chunk_id == b"fmt ":
+                self._fmt = data[body:body + chunk_size]
+            offset = body + chunk_size + (chunk_size & 1)
+
+    def _wav(self, pcm):
+        fmt = self._fmt
+        return (b"RIFF" + struct.pack("<I", 4 + 8 + len(fmt) + 8 + len(pcm)) + b"WAVE"
+                + b"fmt " + struct.pack("<I", len(fmt)) + fmt
+                + b"data" + struct.pack("<I", len(pcm)) + pcm)
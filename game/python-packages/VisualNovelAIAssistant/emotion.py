@@ -0,0 +1,62 @@
+import re
+
+_SEPARATORS = re.compile(r"[\s,，、|/]+")
+
+
+def _normalize(name):
+    return name.strip().lower().replace("-", "_")
+
+
+class EmotionTable:
+    """
+    Live2D 动作和表情的查找表，在启动时由模型目录中的名字构建一次，
+    之后每句回复的 <em> 标签只需查表
+    """
+
+    def __init__(self, motions=(), exps=()):
+        """
+        :param motions: 动作名列表(如 CharacterPreprocessor.motions)
+        :param exps: 表情名列表(如 CharacterPreprocessor.exps)
+        """
+        self.motions = sorted(set(motions))
+        self.exps = sorted(set(exps))
+        self._lookup = {} # 规范化的名字 -> ("motion" | "exp", 原名)
+        for exp in self.exps:
+            self._lookup[_normalize(exp)] = ("exp", exp)
+        for motion in self.motions:
+            self._lookup[_normalize(motion)] = ("motion", motion)
+        self.unknown = 0 # 无法识别的名字数
+
+    def __bool__(self):
+        return bool(self._lookup)
+
+    def resolve(self, tag_content):
+        """
+        解析 <em> 标签的内容，可同时包含一个动作和一个表情
+        :param tag_content: 如 "mtn_02" 或 "mtn_02,smile"
+        :return: (动作名或 None, 表情名或 None)
+        """
+        found = {"motion": None, "exp": None}
+        for name in _SEPARATORS.split(tag_content):
+            if not name:
+                continue
+            entry = self._lookup.get(_normalize(name))
+            if entry is None:
+                self.unknown += 1
+                continue
+            kind, original = entry
+            if found[kind] is None:
+                found[kind] = original
+        return found["motion"], found["exp"]
+
+    def prompt(self):
+        """告知模型可用名字的系统提示，内容只由名字列表决定，保持不变以命中前缀缓存"""
+        lines = ["可选的动作表情标注:",
+                 "-每句日文回复前可以用<em>name</em>标注说这句话时的动作或表情,不需要时省略",
+                 "-name只能从下列名字中选择,动作和表情可以各选一个,用逗号分隔"]
+        if self.motions:
+            lines.append("动作:" + ",".join(self.motions))
+        if self.exps:
+            lines.append("表情:" + ",".join(self.exps))
+        lines.append("举例:<em>" + (self.motions or self.exps)[-1] + "</em><jp>…</jp><cn>…</cn>")
+        return {"role": "system", "content": "\n".join(lines)}
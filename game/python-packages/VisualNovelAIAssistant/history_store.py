@@ -0,0 +1,237 @@
+import json
+import os
+import threading
+import time
+
+
+class HistoryJournal:
+    """
+    追加写入的对话日志(JSONL)
+
+    每轮对话完成时写入一条 turn 记录，每次总结写入一条 summary 记录，
+    记录写入后立即落盘，崩溃时最多丢失正在进行的一轮。
+    活动日志超过阈值后压缩：不再需要的旧记录移入归档文件，
+    加载时只从活动日志尾部读取构建上下文所需的记录
+    """
+
+    def __init__(self, path="history/journal.jsonl", archive_path=None, compact_every=200, keep_turns=50):
+        """
+        :param path: 活动日志路径
+        :param archive_path: 归档文件路径，默认与活动日志同目录的 archive.jsonl
+        :param compact_every: 写入多少条记录后压缩一次
+        :param keep_turns: 压缩后活动日志至少保留的轮数
+        """
+        self.path = path
+        self.archive_path = archive_path or os.path.join(os.path.dirname(path), "archive.jsonl")
+        self.compact_every = compact_every
+        self.keep_turns = keep_turns
+
+        self._lock = threading.Lock()
+        self._last_turn_id = None  # 首次使用时从日志尾部读取
+        self._appended = 0
+        self._tail_checked = False
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    @property
+    def last_turn_id(self):
+        """最后一轮对话的编号，没有记录时为 -1"""
+        with self._lock:
+            return self._get_last_turn_id()
+
+    def append_turn(self, user, cn, jp, timestamp=None, interrupted=False, prompt_tokens=None, completion_tokens=None):
+        """
+        追加一轮对话，写入失败时本轮编号仍被占用(可由 last_turn_id 读取)，之后的轮次不会与之重复
+        :param user: 用户输入
+        :param cn: 中文回复
+        :param jp: 日文回复
+        :param interrupted: 回复是否被打断(只记录了已显示的部分)
+        :param prompt_tokens: 服务端返回的本轮提示词 token 数，为 None 时不记录
+        :param completion_tokens: 服务端返回的本轮回复 token 数，为 None 时不记录
+        :return: 本轮编号
+        """
+        with self._lock:
+            turn_id = self._get_last_turn_id() + 1
+            self._last_turn_id = turn_id
+            record = {"type": "turn", "id": turn_id, "time": timestamp or time.time(),
+                      "user": user, "cn": cn, "jp": jp}
+            if interrupted:
+                record["interrupted"] = True
+            if prompt_tokens is not None:
+                record["prompt_tokens"] = prompt_tokens
+            if completion_tokens is not None:
+                record["completion_tokens"] = completion_tokens
+            self._append(record)
+            return turn_id
+
+    def append_summary(self, content, until):
+        """
+        追加一条总结
+        :param content: 总结内容
+        :param until: 总结覆盖到的最后一轮编号
+        """
+        with self._lock:
+            self._append({"type": "summary", "time": time.time(), "until": until, "content": content})
+
+    def load_tail(self, tail_turns=None):
+        """
+        从活动日志尾部读取上下文
+        :param tail_turns: 至少读取的轮数，默认为 keep_turns
+        :return: (最新的 summary 记录或 None, 按时间顺序排列的 turn 记录)
+        """
+        tail_turns = self.keep_turns if tail_turns is None else tail_turns
+        summary = None
+        turns = []
+
+        with self._lock:
+            for record in self._read_reversed():
+                if record.get("type") == "summary":
+                    if summary is None:
+                        summary = record
+                elif record.get("type") == "turn":
+                    if summary is None or len(turns) < tail_turns:
+                        turns.append(record)
+                if summary is not None and len(turns) >= tail_turns:
+                    break
+
+            if turns and self._last_turn_id is None:
+                self._last_turn_id = turns[0]["id"]
+
+        turns.reverse()
+        return summary, turns
+
+    def read_turns(self, before_id, limit):
+        """
+        分页读取较早的对话(依次读取活动日志和归档文件)
+        :param before_id: 只返回编号小于该值的轮次
+        :param limit: 最多返回的轮数
+        :return: 按时间顺序排列的 turn 记录
+        """
+        turns = []
+        with self._lock:
+            for path in (self.path, self.archive_path):
+                for record in self._read_reversed(path):
+                    if record.get("type") == "turn" and record["id"] < before_id:
+                        turns.append(record)
+                        if len(turns) >= limit:
+                            break
+                if len(turns) >= limit:
+                    break
+        turns.reverse()
+        return turns
+
+    def compact(self):
+        """将最新总结之前且超出 keep_turns 的记录移入归档文件"""
+        with self._lock:
+            self._compact()
+
+    def _append(self, record):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        if not self._tail_checked:
+            # 崩溃可能留下没有换行的半行，避免新记录与其拼接
+            self._tail_checked = True
+            if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+                with open(self.path, "rb") as f:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        line = "\n" + line
+
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+
+        self._appended += 1
+        if self._appended >= self.compact_every:
+            self._compact()
+
+    def _compact(self):
+        self._appended = 0
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, "r", encoding="utf-8") as f:
+            lines = [line for line in f if line.strip()]
+
+        # 找到需要保留的起始位置：最新总结和最近 keep_turns 轮中较早的那个
+        keep_from = len(lines)
+        turns_seen = 0
+        summary_found = False
+        for index in range(len(lines) - 1, -1, -1):
+            record = self._decode(lines[index].encode("utf-8")) or {}
+            if record.get("type") == "turn":
+                turns_seen += 1
+                if turns_seen <= self.keep_turns:
+                    keep_from = index
+            elif record.get("type") == "summary" and not summary_found:
+                summary_found = True
+                keep_from = min(keep_from, index)
+            if summary_found and turns_seen >= self.keep_turns:
+                break
+
+        if keep_from == 0:
+            return
+
+        # 先归档，再原子替换活动日志
+        with open(self.archive_path, "a", encoding="utf-8") as f:
+            f.writelines(lines[:keep_from])
+            f.flush()
+            os.fsync(f.fileno())
+
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.writelines(lines[keep_from:])
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def _get_last_turn_id(self):
+        if self._last_turn_id is None:
+            self._last_turn_id = -1
+            for path in (self.path, self.archive_path):
+                for record in self._read_reversed(path):
+                    if record.get("type") == "turn":
+                        self._last_turn_id = record["id"]
+                        return self._last_turn_id
+        return self._last_turn_id
+
+    def _read_reversed(self, path=None, block_size=64 * 1024):
+        """从文件末尾开始逐行读取记录，跳过损坏的行"""
+        path = path or self.path
+        if not os.path.exists(path):
+            return
+
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            position = f.tell()
+            remainder = b""
+            while position > 0:
+                read_size = min(block_size, position)
+                position -= read_size
+                f.seek(position)
+                data = f.read(read_size) + remainder
+                lines = data.split(b"\n")
+                remainder = lines.pop(0)
+                for line in reversed(lines):
+                    record = self._decode(line)
+                    if record is not None:
+                        yield record
+            record = self._decode(remainder)
+            if record is not None:
+                yield record
+
+    @staticmethod
+    def _decode(line):
+        line = line.strip()
+        if not line:
+            return None
+        try:
+            return json.loads(line.decode("utf-8"))
+        except ValueError:
+            # 崩溃时可能留下写了一半的最后一行
+            return None
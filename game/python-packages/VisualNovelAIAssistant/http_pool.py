@@ -0,0 +1,116 @@
+import logging
+import socket
+import threading
+import time
+
+import requests
+
+
+class ConnectionPool:
+    """
+    LLM、总结和 TTS 共用的 HTTP 连接池
+
+    http 和 https 共用一个会话并复用长连接；可在启动时预先建立连接，
+    空闲时定期发送探测请求，避免服务端关闭空闲连接后重新握手
+    """
+
+    def __init__(self, pool_connections=10, pool_maxsize=16):
+        """
+        :param pool_connections: 缓存连接池的主机数
+        :param pool_maxsize: 每个主机保留的最大连接数
+        """
+        self.session = requests.Session()
+        self.adapter = requests.adapters.HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+
+        self.logger = logging.getLogger(__name__)
+        self.last_used = time.monotonic()
+        self._stop = threading.Event()
+        self._keepalive_thread = None
+
+    def request(self, method, url, **kwargs):
+        self.last_used = time.monotonic()
+        return self.session.request(method, url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def warm(self, urls, timeout=5):
+        """
+        预先与各服务建立连接(忽略响应状态码)
+        :param urls: 要预热的地址
+        """
+        for url in urls:
+            start = time.perf_counter()
+            try:
+                self.session.head(url, timeout=timeout).close()
+                self.logger.info("Connection to %s warmed in %.1f ms", url, (time.perf_counter() - start) * 1000)
+            except requests.exceptions.RequestException as e:
+                self.logger.info("Warming connection to %s failed: %s", url, e)
+
+    def keep_alive(self, urls, interval=30.0, ping=None, last_used=None):
+        """
+        启动保活线程：连接池空闲超过 interval 秒时重新探测各服务
+        :param ping: 探测函数，参数为地址列表，默认为 warm
+        :param last_used: 返回其他客户端(如 asyncio 流水线)最近一次请求时刻的函数，也计入空闲判断
+        """
+        if self._keepalive_thread is not None or not interval:
+            return
+        ping = ping or self.warm
+
+        def idle_since():
+            if last_used is None:
+                return self.last_used
+            return max(self.last_used, last_used())
+
+        def run():
+            while not self._stop.wait(interval):
+                if time.monotonic() - idle_since() >= interval:
+                    ping(urls)
+                    self.last_used = time.monotonic()
+
+        self._keepalive_thread = threading.Thread(target=run, name="http-keepalive", daemon=True)
+        self._keepalive_thread.start()
+
+    def stats(self):
+        """
+        各主机的连接数和请求数，reused 为复用已有连接的请求数
+        """
+        hosts = []
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            hosts.append({
+                "host": f"{pool.scheme}://{pool.host}:{pool.port}",
+                "connections": pool.num_connections,
+                "requests": pool.num_requests,
+                "reused": max(0, pool.num_requests - pool.num_connections),
+            })
+        return {
+            "connections": sum(host["connections"] for host in hosts),
+            "requests": sum(host["requests"] for host in hosts),
+            "reused": sum(host["reused"] for host in hosts),
+            "hosts": hosts,
+        }
+
+    def close(self):
+        self._stop.set()
+        self.session.close()
+
+
+def abort_response(response):
+    """
+    立即中断流式响应：其他线程正阻塞在读取中时，直接 close 会等到读取返回，
+    因此先关闭底层套接字使读取立即结束
+    """
+    connection = getattr(response.raw, "connection", None)
+    sock = getattr(connection, "sock", None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    response.close()
@@ -0,0 +1,130 @@
+import math
+import re
+import threading
+from collections import Counter
+
+from .tokens import estimate_tokens
+
+_WORD = re.compile(r"[0-9a-z]+")
+_CJK = re.compile(r"[\u3040-\u30ff\u3400-\u9fff\uf900-\ufaff\uac00-\ud7af]+") # 假名、汉字和谚文
+
+
+def tokenize(text):
+    """
+    将文本切分为检索词项：中日文按相邻两字切分，其他文字按单词切分
+    :param text: 文本
+    """
+    text = text.lower()
+    terms = _WORD.findall(text)
+    for run in _CJK.findall(text):
+        if len(run) == 1:
+            terms.append(run)
+        else:
+            terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return terms
+
+
+class MemoryIndex:
+    """
+    过往对话的本地 BM25 检索索引(长期记忆)
+
+    每轮对话(用户输入 + 中文回复)作为一篇文档，最多保留 max_docs 篇，
+    超出时丢弃最早加入的。可在任意线程调用
+    """
+
+    def __init__(self, max_docs=5000, k1=1.5, b=0.75):
+        """
+        :param max_docs: 最多索引的轮数
+        :param k1: BM25 词频饱和参数
+        :param b: BM25 文档长度归一化参数
+        """
+        self.max_docs = max_docs
+        self.k1 = k1
+        self.b = b
+
+        self._lock = threading.Lock()
+        self._docs = {}      # 轮次编号 -> (时间, 用户输入, 中文回复, 词项数)
+        self._postings = {}  # 词项 -> {轮次编号: 词频}
+        self._total_length = 0
+
+    def __len__(self):
+        return len(self._docs)
+
+    def add(self, record):
+        """
+        加入一轮对话，已存在的轮次忽略
+        :param record: TurnRecord
+        """
+        terms = Counter(tokenize(record.user + "\n" + record.cn))
+        length = sum(terms.values())
+        with self._lock:
+            if record.id in self._docs:
+                return
+            self._docs[record.id] = (record.time, record.user, record.cn, length)
+            self._total_length += length
+            postings = self._postings
+            for term, freq in terms.items():
+                entry = postings.get(term)
+                if entry is None:
+                    postings[term] = {record.id: freq}
+                else:
+                    entry[record.id] = freq
+            while len(self._docs) > self.max_docs:
+                self._remove(next(iter(self._docs)))
+
+    def search(self, query, limit=3, max_id=None):
+        """
+        :param query: 查询文本
+        :param limit: 最多返回的条数
+        :param max_id: 只检索编号不大于该值的轮次(更新的轮次仍在上下文中)
+        :return: 按相关度从高到低排列的 (分数, 轮次编号, 时间, 用户输入, 中文回复)
+        """
+        terms = set(tokenize(query))
+        scores = {}
+        with self._lock:
+            count = len(self._docs)
+            if not count or not terms:
+                return []
+            average_length = self._total_length / count
+
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, freq in postings.items():
+                    if max_id is not None and doc_id > max_id:
+                        continue
+                    length = self._docs[doc_id][3]
+                    norm = freq + self.k1 * (1 - self.b + self.b * length / average_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * freq * (self.k1 + 1) / norm
+
+            best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+            return [(score, doc_id) + self._docs[doc_id][:3] for doc_id, score in best]
+
+    def select(self, query, limit=3, max_id=None, token_budget=400):
+        """
+        检索并按 token 预算挑选结果
+        :param token_budget: 所选对话的估算 token 总数上限
+        :return: 按时间顺序排列的 (轮次编号, 时间, 用户输入, 中文回复)
+        """
+        selected = []
+        used = 0
+        for _, doc_id, timestamp, user, reply in self.search(query, limit, max_id):
+            tokens = estimate_tokens(user) + estimate_tokens(reply) + 8
+            if used + tokens > token_budget:
+                continue
+            used += tokens
+            selected.append((doc_id, timestamp, user, reply))
+        selected.sort()
+        return selected
+
+    def _remove(self, doc_id):
+        _, user, reply, length = self._docs.pop(doc_id)
+        self._total_length -= length
+        for term in set(tokenize(user + "\n" + reply)):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[term]
@@ -0,0 +1,157 @@
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+
+
+class TurnTimeline:
+    """
+    一轮对话的时间线
+
+    所有时间点都以 time.perf_counter() 记录，导出时转换为相对于
+    输入入队时刻的毫秒数
+    """
+
+    def __init__(self, turn_id, text=""):
+        self.turn_id = turn_id
+        self.text = text
+        self.created = time.time()
+        self.origin = time.perf_counter()
+        self.marks = {"input_enqueued": self.origin}
+        self.sentences = {}   # seq -> 句子解析完成时刻
+        self.tts = {}         # seq -> [开始时刻, 结束时刻]
+        self.replies = {}     # seq -> 回复包发出时刻
+        self.usage = {}
+
+    def mark(self, name, timestamp=None):
+        """记录一个时间点，同名时间点只记录第一次"""
+        self.marks.setdefault(name, timestamp or time.perf_counter())
+
+    def sentence(self, seq):
+        self.sentences[seq] = time.perf_counter()
+
+    def tts_start(self, seq):
+        self.tts[seq] = [time.perf_counter(), None]
+
+    def tts_end(self, seq):
+        self.tts.setdefault(seq, [time.perf_counter(), None])[1] = time.perf_counter()
+
+    def reply(self, seq):
+        now = time.perf_counter()
+        self.replies[seq] = now
+        self.mark("first_reply", now)
+
+    def since(self, name, start="input_enqueued"):
+        """两个时间点之间的毫秒数，缺少任一时间点时返回 None"""
+        if name not in self.marks or start not in self.marks:
+            return None
+        return (self.marks[name] - self.marks[start]) * 1000
+
+    def durations(self):
+        """本轮的关键阶段耗时(毫秒)"""
+        values = {
+            "queue_wait": self.since("request_sent"),
+            "retrieval": self.since("retrieval_end", "retrieval_start"),
+            "first_byte": self.since("first_byte", "request_sent"),
+            "first_token": self.since("first_token", "request_sent"),
+            "first_reply": self.since("first_reply"),
+            "turn_total": self.since("turn_end"),
+        }
+        if self.sentences:
+            values["first_sentence"] = (min(self.sentences.values()) - self.origin) * 1000
+        return {name: value for name, value in values.items() if value is not None}
+
+    def to_dict(self):
+        def relative(timestamp):
+            return None if timestamp is None else round((timestamp - self.origin) * 1000, 1)
+
+        return {
+            "turn": self.turn_id,
+            "time": self.created,
+            "marks": {name: relative(value) for name, value in self.marks.items()},
+            "sentences": {seq: relative(value) for seq, value in self.sentences.items()},
+            "tts": {seq: [relative(start), relative(end)] for seq, (start, end) in self.tts.items()},
+            "replies": {seq: relative(value) for seq, value in self.replies.items()},
+            "usage": self.usage,
+        }
+
+
+class LatencyStats:
+    """
+    汇总最近若干轮的耗时，提供 p50/p95/p99
+    """
+
+    def __init__(self, window=200):
+        """
+        :param window: 每项指标保留的最近样本数
+        """
+        self.window = window
+        self._values = {}
+        self._timelines = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, timeline):
+        """记录一轮完成的对话"""
+        with self._lock:
+            self._timelines.append(timeline)
+            for name, value in timeline.durations().items():
+                self._add(name, value)
+            for start, end in timeline.tts.values():
+                if end is not None:
+                    self._add("tts", (end - start) * 1000)
+
+    def record_value(self, name, value):
+        """记录单个样本(毫秒)"""
+        with self._lock:
+            self._add(name, value)
+
+    def summary(self):
+        """各项指标的样本数、平均值和 p50/p95/p99(毫秒)"""
+        with self._lock:
+            return {name: self._describe(values) for name, values in self._values.items() if values}
+
+    def recent(self, count=20):
+        """最近几轮的完整时间线"""
+        with self._lock:
+            return [timeline.to_dict() for timeline in list(self._timelines)[-count:]]
+
+    def dump(self, path, extra=None):
+        """
+        将统计结果写入 JSON 文件
+        :param path: 输出路径
+        :param extra: 附加写入的字段
+        """
+        data = {"time": time.time(), "latency": self.summary(), "recent": self.recent()}
+        data.update(extra or {})
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+    def _add(self, name, value):
+        values = self._values.get(name)
+        if values is None:
+            values = self._values[name] = deque(maxlen=self.window)
+        values.append(value)
+
+    @staticmethod
+    def _describe(values):
+        ordered = sorted(values)
+
+        def percentile(p):
+            index = min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))
+            return round(ordered[index], 1)
+
+        return {
+            "count": len(ordered),
+            "mean": round(sum(ordered) / len(ordered), 1),
+            "p50": percentile(50),
+            "p95": percentile(95),
+            "p99": percentile(99),
+        }
@@ -0,0 +1,278 @@
+import time
+from queue import Full, Queue
+
+
+class BoundedQueue(Queue):
+    """
+    有容量上限的队列：队列满时 put 阻塞(背压)并统计阻塞次数和时长；
+    close 后 put 不再阻塞，保证退出标记总能送达
+    """
+
+    def __init__(self, maxsize=0):
+        """
+        :param maxsize: 最多容纳的条目数，0 为不限
+        """
+        super().__init__(maxsize)
+        self.closed = False
+        self.stalls = 0 # put 因队列满而等待的次数
+        self.stall_time = 0.0 # put 等待的总时长(秒)
+        self.drops = 0 # 因超出上限而丢弃的条目(或其中的数据)数
+
+    def put(self, item, block=True, timeout=None):
+        with self.not_full:
+            if self._should_wait(item) and not self.closed:
+                if not block:
+                    raise Full
+                self.stalls += 1
+                start = time.perf_counter()
+                deadline = None if timeout is None else start + timeout
+                try:
+                    while self._should_wait(item) and not self.closed:
+                        remaining = None if deadline is None else deadline - time.perf_counter()
+                        if remaining is not None and remaining <= 0:
+                            raise Full
+                        self.not_full.wait(remaining)
+                finally:
+                    self.stall_time += time.perf_counter() - start
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+    def wait_for_space(self, item, timeout=None):
+        """
+        等待直到可以不阻塞地放入 item(或队列已关闭)，计入等待次数和时长，
+        供需要在锁内以 put(block=False) 放入的调用方在锁外等待
+        :return: 是否可以放入
+        """
+        with self.not_full:
+            if not self._should_wait(item) or self.closed:
+                return True
+            self.stalls += 1
+            start = time.perf_counter()
+            try:
+                self.not_full.wait(timeout)
+            finally:
+                self.stall_time += time.perf_counter() - start
+            return not self._should_wait(item) or self.closed
+
+    def close(self, sentinel=None):
+        """
+        不再限制容量并放入退出标记
+        :param sentinel: 退出标记，为 None 时只解除阻塞
+        """
+        with self.not_full:
+            self.closed = True
+            if sentinel is not None:
+                self._put(sentinel)
+                self.unfinished_tasks += 1
+                self.not_empty.notify_all()
+            self.not_full.notify_all()
+
+    def stats(self):
+        with self.mutex:
+            return {
+                "size": self._qsize(),
+                "maxsize": self.maxsize,
+                "stalls": self.stalls,
+                "stall_ms": round(self.stall_time * 1000, 1),
+                "drops": self.drops,
+            }
+
+    def _should_wait(self, item):
+        return 0 < self.maxsize <= self._qsize()
+
+
+class ReplyQueue(BoundedQueue):
+    """
+    回复队列：除条目数上限外，还限制队列中语音数据的总字节数，
+    游戏取出回复包时释放相应的额度。游戏暂停或玩家阅读较慢时，
+    后台线程在额度用尽后等待(overflow="block")，或只保留文字丢弃语音(overflow="drop_audio")
+
+    流式语音的后续片段(AudioSegmentQueue)也计入同一额度，游戏取出片段时释放
+    """
+
+    def __init__(self, maxsize=0, max_audio_bytes=32 * 1024 * 1024, overflow="block"):
+        """
+        :param maxsize: 最多容纳的回复包数，0 为不限
+        :param max_audio_bytes: 队列中语音数据的总字节数上限
+        :param overflow: 超出字节上限时的处理方式，"block" 或 "drop_audio"
+        """
+        super().__init__(maxsize)
+        self.max_audio_bytes = max_audio_bytes
+        self.overflow = overflow
+        self.audio_bytes = 0 # 队列中语音数据的总字节数
+
+    def put(self, item, block=True, timeout=None):
+        if self.overflow == "drop_audio":
+            size = self._audio_size(item)
+            with self.mutex:
+                over_budget = size and self.audio_bytes and self.audio_bytes + size > self.max_audio_bytes
+                if over_budget:
+                    self.drops += 1
+            if over_budget:
+                # 语音文件已写好时仍可播放，只丢弃内存中的数据
+                item = {**item, "audio": None}
+        super().put(item, block, timeout)
+
+    def stats(self):
+        stats = super().stats()
+        with self.mutex:
+            stats["audio_bytes"] = self.audio_bytes
+            stats["max_audio_bytes"] = self.max_audio_bytes
+        return stats
+
+    def reserve(self, size, timeout=None, abandoned=None, overdraft=None):
+        """
+        为一个流式语音片段占用额度，额度用尽时等待
+        :param size: 片段的字节数
+        :param timeout: 最长等待时间(秒)，超时抛出 Full
+        :param abandoned: 返回 True 时放弃等待的函数(如片段队列已被丢弃)
+        :param overdraft: 返回 True 时不受额度限制的函数(如游戏正在等待该片段队列)
+        :return: 是否已占用额度；放弃、队列已关闭或 overflow="drop_audio" 超出额度时为 False
+        """
+        def must_wait():
+            return self._over_budget(size) and not (overdraft is not None and overdraft())
+
+        with self.not_full:
+            if must_wait():
+                if self.overflow == "drop_audio":
+                    self.drops += 1
+                    return False
+                self.stalls += 1
+                start = time.perf_counter()
+                deadline = None if timeout is None else start + timeout
+                try:
+                    while must_wait() and not self.closed:
+                        if abandoned is not None and abandoned():
+                            return False
+                        remaining = 0.5 if deadline is None else min(0.5, deadline - time.perf_counter())
+                        if remaining <= 0:
+                            raise Full
+                        self.not_full.wait(remaining)
+                finally:
+                    self.stall_time += time.perf_counter() - start
+            if self.closed or (abandoned is not None and abandoned()):
+                return False
+            self.audio_bytes += size
+            return True
+
+    def release(self, size):
+        """归还流式语音片段占用的额度"""
+        if not size:
+            return
+        with self.not_full:
+            self.audio_bytes -= size
+            self.not_full.notify_all()
+
+    def _over_budget(self, size):
+        return bool(size and self.audio_bytes and self.audio_bytes + size > self.max_audio_bytes)
+
+    def _should_wait(self, item):
+        if super()._should_wait(item):
+            return True
+        # 队列中没有回复包时总是放入：单个超大的回复包不会永久阻塞，
+        # 正在接收的流式片段占满额度时，游戏也总能取到下一个回复包并开始消耗片段
+        return bool(self._qsize() and self._over_budget(self._audio_size(item)))
+
+    def _put(self, item):
+        super()._put(item)
+        self.audio_bytes += self._audio_size(item)
+
+    def _get(self):
+        item = super()._get()
+        self.audio_bytes -= self._audio_size(item)
+        return item
+
+    @staticmethod
+    def _audio_size(item):
+        audio = item.get("audio") if isinstance(item, dict) else None
+        return len(audio) if isinstance(audio, (bytes, bytearray)) else 0
+
+
+class AudioSegmentQueue(BoundedQueue):
+    """
+    流式语音的后续片段队列，以 None 结束：片段数有上限，每个片段的字节数
+    计入回复队列(ReplyQueue)的语音额度，游戏取出片段时归还；队列为空时允许超出额度一个片段，
+    保证游戏正在播放的句子总能继续接收。
+    游戏不再播放时(换到下一句或打断)应调用 discard，归还剩余片段的额度并停止接收
+    """
+
+    def __init__(self, maxsize=0, budget=None):
+        """
+        :param maxsize: 最多容纳的片段数，0 为不限
+        :param budget: 共用语音额度的 ReplyQueue，为 None 时只限制片段数
+        """
+        super().__init__(maxsize)
+        self.budget = budget
+        self.discarded = False
+
+    def put(self, item, block=True, timeout=None):
+        """
+        放入一个片段，额度或片段数达到上限时等待
+        :return: 是否已放入；已丢弃或 overflow="drop_audio" 超出额度时为 False
+        """
+        size = self._audio_size(item)
+        if self.discarded:
+            return False
+        if size and self.budget is not None:
+            # 片段队列为空时游戏可能正在等待本句的下一个片段：允许超出额度，
+            # 否则其他句子的片段占满额度时本句永远无法放入
+            if not self.budget.reserve(size, timeout if block else 0,
+                                       lambda: self.discarded, lambda: not self._qsize()):
+                return False
+        try:
+            super().put(item, block, timeout)
+        except Full:
+            if size and self.budget is not None:
+                self.budget.release(size)
+            raise
+        return True
+
+    def end(self):
+        """放入结束标记，不受片段数上限限制"""
+        with self.not_full:
+            if self.discarded:
+                return
+            self.closed = True
+            super()._put(None)
+            self.unfinished_tasks += 1
+            self.not_empty.notify_all()
+            self.not_full.notify_all()
+
+    def discard(self):
+        """丢弃尚未取出的片段并归还额度，之后放入的片段直接丢弃，读取方随即读到结束标记"""
+        with self.not_full:
+            if self.discarded:
+                return
+            self.discarded = True
+            self.closed = True
+            while self._qsize():
+                self._get()
+            super()._put(None)
+            self.not_empty.notify_all()
+            self.not_full.notify_all()
+        if self.budget is not None:
+            # 唤醒等待额度的接收线程
+            with self.budget.not_full:
+                self.budget.not_full.notify_all()
+
+    def _put(self, item):
+        if self.discarded:
+            # 在 discard 之后才放入的片段：归还已占用的额度
+            self._release(item)
+            return
+        super()._put(item)
+
+    def _get(self):
+        item = super()._get()
+        self._release(item)
+        return item
+
+    def _release(self, item):
+        size = self._audio_size(item)
+        if size and self.budget is not None:
+            self.budget.release(size)
+
+    @staticmethod
+    def _audio_size(item):
+        return len(item) if isinstance(item, (bytes, bytearray)) else 0
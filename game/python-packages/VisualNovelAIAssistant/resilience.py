@@ -0,0 +1,192 @@
+import asyncio
+import json
+import random
+import threading
+import time
+from itertools import chain
+from queue import Empty, Queue
+
+import requests
+
+from .aio_http import HTTPError
+from .http_pool import abort_response
+
+
+class LLMEndpoint:
+    """一个 LLM 接口：地址、密钥和模型"""
+
+    def __init__(self, name, url, api_key, model):
+        self.name = name
+        self.url = url
+        self.api_key = api_key
+        self.model = model
+
+    def headers(self):
+        return {"Content-Type": "application/json", "Authorization": f"Bearer {self.api_key}"}
+
+    def body(self, request_data):
+        return json.dumps({**request_data, "model": self.model})
+
+
+class FirstTokenTimeout(Exception):
+    """超过首个数据块的等待时限"""
+
+
+def backoff_delay(retry, base=0.5, cap=4.0):
+    """
+    带随机抖动的指数退避时间(秒)
+    :param retry: 第几次重试，从 0 开始
+    """
+    return random.uniform(0, min(cap, base * 2 ** retry))
+
+
+def is_retryable(error):
+    """网络错误、超时、429 和 5xx 可以重试，其余错误(如 401)重试也不会成功"""
+    if isinstance(error, requests.exceptions.HTTPError):
+        status = error.response.status_code if error.response is not None else 0
+        return status == 429 or status >= 500
+    if isinstance(error, HTTPError):
+        return error.status == 429 or error.status >= 500
+    if isinstance(error, requests.exceptions.RequestException):
+        # InvalidURL、MissingSchema 等配置错误同样继承自 RequestException(部分还继承 OSError)，不重试
+        return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+    # asyncio 引擎的网络错误直接以 OSError 的形式抛出
+    return isinstance(error, (FirstTokenTimeout, OSError, asyncio.TimeoutError, asyncio.IncompleteReadError))
+
+
+class StreamAttempt:
+    """
+    在独立线程中发出一次流式请求，读到首个数据块为止；
+    之后由调用方继续读取剩余的行
+    """
+
+    def __init__(self, pool, endpoint, request_data, timeout, results):
+        self.endpoint = endpoint
+        self.response = None
+        self.closed = False
+
+        self._buffered = [] # 首个数据块及之前的行
+        self._lines = iter(())
+        self._thread = threading.Thread(target=self._run, args=(pool, request_data, timeout, results), daemon=True)
+        self._thread.start()
+
+    def iter_lines(self):
+        return chain(self._buffered, self._lines)
+
+    def close(self):
+        self.closed = True
+        response = self.response
+        if response is not None:
+            abort_response(response)
+
+    def _run(self, pool, request_data, timeout, results):
+        try:
+            response = pool.post(
+                self.endpoint.url,
+                headers=self.endpoint.headers(),
+                data=self.endpoint.body(request_data),
+                timeout=timeout,
+                stream=True
+            )
+            self.response = response
+            if self.closed:
+                response.close()
+                return
+            response.raise_for_status()
+
+            self._lines = response.iter_lines()
+            for line in self._lines:
+                self._buffered.append(line)
+                if line.startswith(b"data: "):
+                    break
+            results.put((self, None))
+        except Exception as e:
+            results.put((self, e))
+
+
+class StreamRace:
+    """
+    一次带首 token 时限的流式请求，可选在主接口迟迟没有数据时
+    向备用接口发出对冲请求，先返回数据的请求胜出，另一个被关闭
+    """
+
+    def __init__(self, pool, request_data, timeout, logger):
+        """
+        :param pool: ConnectionPool
+        :param request_data: 请求体(不含 model)
+        :param timeout: 连接和读取的超时时间(秒)
+        """
+        self.pool = pool
+        self.request_data = request_data
+        self.timeout = timeout
+        self.logger = logger
+        self.hedged = False
+
+        self._results = Queue()
+        self._attempts = []
+
+    def run(self, primary, first_token_timeout, hedge=None, hedge_delay=None):
+        """
+        :param primary: 主接口
+        :param first_token_timeout: 等待首个数据块的最长时间(秒)
+        :param hedge: 备用接口，为 None 时不对冲
+        :param hedge_delay: 主接口超过该秒数仍无数据(或提前失败)时向备用接口发出请求
+        :return: (胜出的 StreamAttempt, None) 或 (None, 最后一个错误)
+        """
+        self._start(primary)
+        now = time.monotonic()
+        deadline = now + first_token_timeout
+        hedge_at = now + hedge_delay if hedge is not None and hedge_delay is not None else None
+
+        winner = None
+        error = None
+        pending = 1
+        while pending:
+            wait_until = deadline if hedge_at is None else min(deadline, hedge_at)
+            try:
+                attempt, exc = self._results.get(timeout=max(0.0, wait_until - time.monotonic()))
+            except Empty:
+                if hedge_at is not None and time.monotonic() >= hedge_at:
+                    self._start_hedge(hedge)
+                    hedge_at = None
+                    pending += 1
+                    continue
+                error = FirstTokenTimeout(f"No data within {first_token_timeout:.1f} s")
+                break
+
+            if attempt is None:
+                # 被打断
+                error = exc
+                break
+
+            pending -= 1
+            if exc is None:
+                winner = attempt
+                break
+
+            error = exc
+            self.logger.warning("LLM request to %s failed: %s", attempt.endpoint.name, exc)
+            if hedge_at is not None and is_retryable(exc):
+                # 主接口提前失败，立即改用备用接口
+                self._start_hedge(hedge)
+                hedge_at = None
+                pending += 1
+
+        for attempt in self._attempts:
+            if attempt is not winner:
+                attempt.close()
+        return winner, error
+
+    def close(self):
+        """关闭所有请求并唤醒等待中的 run"""
+        for attempt in self._attempts:
+            attempt.close()
+        self._results.put((None, requests.exceptions.ConnectionError("Request cancelled")))
+
+    def _start(self, endpoint):
+        self._attempts.append(StreamAttempt(self.pool, endpoint, self.request_data, self.timeout, self._results))
+
+    def _start_hedge(self, endpoint):
+        self.hedged = True
+        self.logger.info("Hedging LLM request to %s", endpoint.name)
+        self._start(endpoint)
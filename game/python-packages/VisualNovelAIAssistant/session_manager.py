@@ -0,0 +1,273 @@
+import logging
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
+
+from . import VisualNovelAIAssistant, _completed_future
+from .audio_cache import AudioCache
+from .http_pool import ConnectionPool
+from .queues import BoundedQueue
+
+
+class ManagedSession(VisualNovelAIAssistant):
+    """
+    由 SessionManager 调度的会话：不启动自己的线程，
+    LLM 请求、语音合成和后台总结都在管理器的共享线程池中执行
+    """
+
+    def __init__(self, manager, name, reply_queue, **kwargs):
+        """
+        :param manager: 所属的 SessionManager
+        :param name: 会话名，同时作为历史目录名
+        :param reply_queue: 本会话的回复队列
+        :param kwargs: 传给 VisualNovelAIAssistant 的参数
+        """
+        self.manager = manager
+        self.name = name
+        self._inputs = deque() # 尚未处理的输入，由管理器加锁访问
+        self._scheduled = False # 是否已在管理器的就绪队列中或正在处理
+        self._jp_pending = {} # seq -> (日文, 合成 Future)，等待中文翻译
+        # 回复队列满(如游戏暂停)时放入会阻塞，回复包由本会话自己的线程发出，不占用共享的合成线程
+        self._emitter = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"emit-{name}")
+
+        super().__init__(reply_queue=reply_queue, **kwargs)
+
+        # 共享管理器的音频缓存，每个会话最多占用一份在途合成名额
+        self.audio_cache = manager.audio_cache
+        self.tts_max_in_flight = manager.tts_session_slots
+
+    def _create_http_pool(self, pool_maxsize):
+        # 共享管理器的连接池
+        return self.manager.http_pool
+
+    def _create_history_journal(self):
+        # 每个会话使用独立的历史目录
+        self.history_dir = os.path.join(self.manager.history_root, self.name)
+        return super()._create_history_journal()
+
+    def _start_workers(self):
+        # 由管理器的共享线程处理，不启动自己的线程
+        self.dialog_thread = self.monitor_thread = self.tts_thread = self.summary_thread = None
+
+    def close(self, timeout=5.0):
+        """停止本会话(共享的线程池和连接池由管理器关闭)"""
+        self.is_running = False
+        self.manager._remove(self)
+        if isinstance(self.reply_queue, BoundedQueue):
+            self.reply_queue.close()
+        with self._tts_slots:
+            self._tts_slots.notify_all()
+        self._emitter.shutdown(wait=False)
+        self.dump_metrics()
+        self.logger.info("Session %s closed", self.name)
+
+    def _enqueue_input(self, item):
+        self.manager._submit(self, item)
+
+    def _schedule_summary(self, prompt_tokens):
+        self.manager._submit_summary(self)
+
+    def _put_sentence(self, tag, seq, sentence, timeline):
+        """
+        日文句子立即开始合成，中文句子到达后按 seq 顺序等待组装；
+        本会话的在途合成达到上限时等待，不占满共享的合成线程池
+        """
+        if tag == "jp":
+            if not self._acquire_tts_slot():
+                return
+            future = self._submit_tts(self.manager.tts_executor, seq, sentence, timeline)
+            self._jp_pending[seq] = (sentence, future)
+        else:
+            entry = self._jp_pending.pop(seq, None)
+            if entry is None:
+                # 会话已关闭
+                return
+            jp, future = entry
+            self._enqueue_reply(seq, timeline, jp, sentence, future)
+
+    def _end_turn(self, timeline, error=None):
+        if not self._acquire_tts_slot():
+            return
+        self._enqueue_reply(self._get_sequence_number(), timeline, None, None, _completed_future(None), error)
+
+    def _enqueue_reply(self, seq, timeline, jp, cn, future, error=None):
+        with self._tts_pending_lock:
+            self._tts_pending.append((seq, future, timeline, jp, cn, error))
+        future.add_done_callback(self._schedule_flush)
+
+    def _schedule_flush(self, _future=None):
+        try:
+            self._emitter.submit(self._flush_replies)
+        except RuntimeError:
+            # 会话已关闭
+            pass
+
+    def _flush_replies(self):
+        """将队首已完成合成的句子按 seq 顺序组装成回复包，只在本会话的发送线程中执行"""
+        while True:
+            with self._tts_pending_lock:
+                if not (self._tts_pending and self._tts_pending[0][1].done()):
+                    return
+                seq, future, timeline, jp, cn, error = self._tts_pending.popleft()
+            audio = future.result()
+            stream = None
+            if isinstance(audio, tuple):
+                # 流式语音：首个片段 + 后续片段队列
+                audio, stream = audio
+            self._emit_reply(seq, timeline, jp, cn, audio, stream, error)
+            self._release_tts_slot()
+
+
+class SessionManager:
+    """
+    在共享的线程池和连接池上运行多个独立会话(多个角色或多个玩家)
+
+    每个会话有自己的人设、历史目录和回复队列；有待处理输入的会话轮流获得
+    对话线程，每个会话同一时间只处理一轮，LLM 和 TTS 的并发数受全局上限约束
+    """
+
+    def __init__(self, api_key, api_url="https://api.openai.com/v1/chat/completions", model="gpt-3.5-turbo",
+                 llm_concurrency=2, tts_concurrency=4, history_root="history"):
+        """
+        :param api_key: 各会话默认使用的 API 密钥
+        :param api_url: 各会话默认使用的 API URL
+        :param model: 各会话默认使用的模型
+        :param llm_concurrency: 同时进行的 LLM 请求(含后台总结)上限，也是对话线程数
+        :param tts_concurrency: 同时进行的语音合成上限
+        :param history_root: 各会话历史目录的上级目录
+        """
+        self.api_key = api_key
+        self.api_url = api_url
+        self.model = model
+        self.history_root = history_root
+
+        self.http_pool = ConnectionPool(pool_maxsize=max(16, llm_concurrency + tts_concurrency))
+        self.audio_cache = AudioCache()
+        self.tts_executor = ThreadPoolExecutor(max_workers=tts_concurrency, thread_name_prefix="tts")
+        # 每个会话最多占用的在途合成数(含等待组装的结果)，同时处理输入的会话平分全局名额
+        self.tts_session_slots = max(2, tts_concurrency * 2 // llm_concurrency)
+        self._summary_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="summary")
+        self._llm_slots = threading.BoundedSemaphore(llm_concurrency)
+
+        self.logger = logging.getLogger(__name__)
+        self.sessions = {}
+        self.is_running = True
+        self._ready = deque() # 有待处理输入的会话，按轮转顺序排列
+        self._cond = threading.Condition()
+
+        self._workers = []
+        for index in range(llm_concurrency):
+            worker = threading.Thread(target=self._worker, name=f"session-worker-{index}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def create_session(self, name, base_prompt, reply_queue=None, **kwargs):
+        """
+        创建一个会话
+        :param name: 会话名，同时作为历史目录名
+        :param base_prompt: 本会话的人设
+        :param reply_queue: 回复队列，为 None 时新建
+        :param kwargs: 覆盖默认值的 VisualNovelAIAssistant 参数(如 api_url、model、default_params)
+        :return: ManagedSession，可与 VisualNovelAIAssistant 一样使用
+        """
+        params = {"api_key": self.api_key, "api_url": self.api_url, "model": self.model, **kwargs}
+        with self._cond:
+            if name in self.sessions:
+                raise ValueError(f"Session {name} already exists")
+            session = ManagedSession(self, name, reply_queue if reply_queue is not None else Queue(),
+                                     base_prompt=base_prompt, **params)
+            self.sessions[name] = session
+        return session
+
+    def get_session(self, name):
+        return self.sessions.get(name)
+
+    def get_stats(self):
+        """各会话的耗时统计和共享连接池的统计"""
+        with self._cond:
+            sessions = dict(self.sessions)
+        return {
+            "sessions": {name: session.stats.summary() for name, session in sessions.items()},
+            "audio_cache": self.audio_cache.stats(),
+            "connections": self.http_pool.stats(),
+        }
+
+    def close(self, timeout=5.0):
+        """关闭所有会话并停止共享线程"""
+        for session in list(self.sessions.values()):
+            session.close()
+
+        with self._cond:
+            self.is_running = False
+            self._cond.notify_all()
+        for worker in self._workers:
+            if worker is not threading.current_thread():
+                worker.join(timeout)
+
+        self.tts_executor.shutdown(wait=False)
+        self._summary_executor.shutdown(wait=False)
+        self.http_pool.close()
+
+    def _submit(self, session, item):
+        with self._cond:
+            running = self.is_running and session.is_running
+            if running:
+                session._inputs.append(item)
+                if not session._scheduled:
+                    session._scheduled = True
+                    self._ready.append(session)
+                    self._cond.notify()
+        if not running:
+            # 会话已关闭：仍发出结束标记，调用方不会一直等待(已关闭的回复队列不会阻塞)
+            session._emit_reply(session._get_sequence_number(), item['timeline'], None, None, None, None, "closed")
+
+    def _submit_summary(self, session):
+        if self.is_running:
+            self._summary_executor.submit(self._run_summary, session)
+
+    def _run_summary(self, session):
+        with self._llm_slots:
+            session._run_summary()
+
+    def _remove(self, session):
+        with self._cond:
+            if self.sessions.get(session.name) is session:
+                del self.sessions[session.name]
+            session._inputs.clear()
+            try:
+                # 尚在就绪队列中的会话不再调度；正在处理的由工作线程结束时复位
+                self._ready.remove(session)
+                session._scheduled = False
+            except ValueError:
+                pass
+
+    def _worker(self):
+        """对话线程：轮流处理各会话的输入"""
+        while True:
+            with self._cond:
+                while self.is_running and not self._ready:
+                    self._cond.wait()
+                if not self.is_running:
+                    return
+                session = self._ready.popleft()
+                if not (session.is_running and session._inputs):
+                    # 已关闭的会话
+                    session._scheduled = False
+                    continue
+                item = session._inputs.popleft()
+
+            try:
+                with self._llm_slots:
+                    session._handle_input(item)
+            except Exception as e:
+                self.logger.error("Error in session %s: %s", session.name, e)
+            finally:
+                with self._cond:
+                    if session._inputs and session.is_running:
+                        # 排到队尾，其他会话先处理
+                        self._ready.append(session)
+                        self._cond.notify()
+                    else:
+                        session._scheduled = False
@@ -0,0 +1,80 @@
+class TagStreamParser:
+    """
+    增量解析 LLM 流式输出中的 <jp>sentence</jp> / <cn>sentence</cn> 标签
+
+    每次 feed 只扫描新到达的文本，标签可以跨数据块拆分，
+    缓冲区只保留尚未闭合的句子，总开销与回复长度成线性关系
+    """
+
+    def __init__(self, tags=("jp", "cn")):
+        """
+        :param tags: 需要识别的标签名
+        """
+        self._open_tags = {f"<{tag}>": tag for tag in tags}
+        self._max_tag_len = max(len(open_tag) for open_tag in self._open_tags)
+        self._buffer = ""
+        self._pos = 0            # 下一次扫描的起始位置
+        self._tag = None         # 当前所在的标签，None 表示在标签外
+        self._content_start = 0  # 当前标签内容的起始位置
+
+    def feed(self, text):
+        """
+        输入一段新文本
+        :param text: 流式输出的增量内容
+        :return: 本次完成的句子列表 [(tag, content), ...]
+        """
+        buffer = self._buffer + text
+        pos = self._pos
+        events = []
+
+        while True:
+            if self._tag is None:
+                # 在标签外：寻找下一个开始标签
+                start = buffer.find("<", pos)
+                if start == -1:
+                    pos = len(buffer)
+                    break
+
+                head = buffer[start:start + self._max_tag_len]
+                matched = None
+                partial = False
+                for open_tag, tag in self._open_tags.items():
+                    if head.startswith(open_tag):
+                        matched = (open_tag, tag)
+                        break
+                    if open_tag.startswith(head):
+                        partial = True
+
+                if matched:
+                    self._tag = matched[1]
+                    pos = start + len(matched[0])
+                    self._content_start = pos
+                elif partial:
+                    # 开始标签被拆分到下一个数据块
+                    pos = start
+                    break
+                else:
+                    pos = start + 1
+            else:
+                # 在标签内：寻找对应的结束标签
+                close_tag = f"</{self._tag}>"
+                end = buffer.find(close_tag, pos)
+                if end == -1:
+                    # 结束标签可能被拆分，下次从可能的拆分点开始扫描
+                    pos = max(self._content_start, len(buffer) - len(close_tag) + 1)
+                    break
+
+                events.append((self._tag, buffer[self._content_start:end]))
+                self._tag = None
+                pos = end + len(close_tag)
+
+        # 丢弃已经处理完的内容
+        if self._tag is not None:
+            cut = self._content_start
+            self._content_start = 0
+        else:
+            cut = pos
+        self._buffer = buffer[cut:]
+        self._pos = pos - cut
+
+        return events
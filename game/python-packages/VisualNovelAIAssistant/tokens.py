@@ -0,0 +1,18 @@
+def estimate_tokens(text):
+    """
+    粗略估算文本的 token 数，无需加载分词器
+    中日文字符按每字 1 个 token 计，其余字符按每 4 个 1 个 token 计
+    :param text: 文本
+    """
+    if not text:
+        return 0
+    wide = sum(1 for char in text if ord(char) > 0x2E7F)
+    return wide + (len(text) - wide + 3) // 4
+
+
+def estimate_messages_tokens(messages):
+    """
+    估算消息列表的 token 数，每条消息额外计 4 个 token 的格式开销
+    :param messages: [{"role": ..., "content": ...}, ...]
+    """
+    return sum(estimate_tokens(message.get("content")) + 4 for message in messages)
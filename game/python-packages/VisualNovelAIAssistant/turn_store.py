@@ -0,0 +1,160 @@
+from collections import deque
+from collections.abc import Sequence
+
+from .tokens import estimate_messages_tokens
+
+
+class TurnRecord:
+    """
+    一轮对话：用户输入只保存一份，中日文回复共用
+    """
+
+    __slots__ = ("id", "time", "user", "cn", "jp", "tokens", "prompt_tokens", "completion_tokens", "interrupted")
+
+    def __init__(self, turn_id, time, user, cn, jp, prompt_tokens=None, completion_tokens=None, interrupted=False):
+        """
+        :param turn_id: 对话日志中的编号
+        :param time: 完成时间(时间戳)
+        :param prompt_tokens: 服务端返回的本轮提示词 token 数，未返回时为 None
+        :param completion_tokens: 服务端返回的本轮回复 token 数，未返回时为 None
+        """
+        self.id = turn_id
+        self.time = time
+        self.user = user
+        self.cn = cn
+        self.jp = jp
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.interrupted = interrupted
+        # 作为上下文(中文)时的估算 token 数，总结判断时直接累加
+        self.tokens = estimate_messages_tokens(self.messages())
+
+    @classmethod
+    def from_journal(cls, record):
+        """由对话日志中的 turn 记录创建"""
+        return cls(record["id"], record.get("time"), record["user"], record["cn"], record["jp"],
+                   record.get("prompt_tokens"), record.get("completion_tokens"), record.get("interrupted", False))
+
+    def messages(self, lang="cn"):
+        """
+        :param lang: "cn" 或 "jp"
+        :return: 本轮的 user 和 assistant 两条消息
+        """
+        reply = self.jp if lang == "jp" else self.cn
+        return [{"role": "user", "content": self.user}, {"role": "assistant", "content": reply}]
+
+
+class TurnStore:
+    """
+    内存中的最近若干轮对话
+
+    超过 max_turns 时丢弃最早的轮次(它们已写入对话日志，需要时可从磁盘分页读取)；
+    仍在上下文中(晚于最新总结)的轮次不会被丢弃。调用方负责加锁
+    """
+
+    def __init__(self, max_turns=200):
+        """
+        :param max_turns: 内存中最多保留的轮数
+        """
+        self.max_turns = max_turns
+        self.summary = None # 最新总结的内容
+        self.summary_until = -1 # 最新总结覆盖到的最后一轮编号
+        self._turns = deque()
+
+    def __len__(self):
+        return len(self._turns)
+
+    def __iter__(self):
+        return iter(self._turns)
+
+    def __getitem__(self, index):
+        return self._turns[index]
+
+    @property
+    def last_id(self):
+        return self._turns[-1].id if self._turns else self.summary_until
+
+    def append(self, record):
+        self._turns.append(record)
+        while len(self._turns) > self.max_turns and self._turns[0].id <= self.summary_until:
+            self._turns.popleft()
+
+    def reset(self, records, summary=None, summary_until=-1):
+        """用从对话日志加载的记录替换全部内容"""
+        self._turns.clear()
+        self.summary = summary
+        self.summary_until = summary_until
+        for record in records:
+            self.append(record)
+
+    def context_turns(self):
+        """晚于最新总结、仍作为上下文发送的轮次"""
+        return [turn for turn in self._turns if turn.id > self.summary_until]
+
+    def context_tokens(self):
+        """上下文(总结 + 之后的对话)的估算 token 数"""
+        tokens = sum(turn.tokens for turn in self._turns if turn.id > self.summary_until)
+        if self.summary is not None:
+            tokens += estimate_messages_tokens([self.summary_message()])
+        return tokens
+
+    def summary_message(self):
+        return {"role": "assistant", "content": self.summary} if self.summary is not None else None
+
+    def set_summary(self, content, until):
+        """记录新的总结并按上限丢弃已被总结的旧轮次"""
+        self.summary = content
+        self.summary_until = until
+        while len(self._turns) > self.max_turns and self._turns[0].id <= until:
+            self._turns.popleft()
+
+    def context_messages(self):
+        """发送给 API 的上下文消息：最新总结 + 总结之后的对话"""
+        messages = []
+        if self.summary is not None:
+            messages.append(self.summary_message())
+        for turn in self.context_turns():
+            messages.extend(turn.messages())
+        return messages
+
+
+class MessageView(Sequence):
+    """
+    按需由 TurnStore 生成的只读消息列表，兼容原先 history_cn / history_jp 列表的读取方式
+    """
+
+    def __init__(self, store, lang, lock=None):
+        """
+        :param store: TurnStore
+        :param lang: "cn" 或 "jp"
+        :param lock: 读取时持有的锁
+        """
+        self._store = store
+        self._lang = lang
+        self._lock = lock
+
+    def _messages(self):
+        if self._lock is None:
+            return [message for turn in self._store for message in turn.messages(self._lang)]
+        with self._lock:
+            return [message for turn in self._store for message in turn.messages(self._lang)]
+
+    def __len__(self):
+        return len(self._store) * 2
+
+    def __getitem__(self, index):
+        if isinstance(index, int):
+            turn_index, offset = divmod(index if index >= 0 else len(self) + index, 2)
+            if not 0 <= turn_index < len(self._store):
+                raise IndexError("message index out of range")
+            return self._store[turn_index].messages(self._lang)[offset]
+        return self._messages()[index]
+
+    def __iter__(self):
+        return iter(self._messages())
+
+    def copy(self):
+        return self._messages()
+
+    def __repr__(self):
+        return f"MessageView({self._lang}, {len(self._store)} turns)"
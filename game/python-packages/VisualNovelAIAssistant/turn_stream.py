@@ -0,0 +1,109 @@
+import json
+import time
+
+from .tag_parser import TagStreamParser
+
+
+class TurnStream:
+    """
+    一轮流式回复的解析状态：SSE 行 -> 增量标签解析 -> 按 seq 配对的日文/中文句子
+
+    可选的 <em> 标签标注一句的动作/表情，属于等待中文翻译的日文句子，
+    没有等待中的句子时属于下一句日文
+    """
+
+    def __init__(self, assistant, text, timeline):
+        self.assistant = assistant
+        self.text = text
+        self.timeline = timeline
+        self.parser = TagStreamParser(("jp", "cn", "em"))
+        self.metrics = {"time": time.time(), "first_token": None}
+        self.final_response = "" # 完整回复
+        self.sentences = [] # 已配对的句子 (seq, 日文, 中文或 None)
+        self.done = False
+
+        self._jp_seq = None # 等待中文翻译的日文句子序号
+        self._jp_pending = "" # 等待中文翻译的日文句子
+        self._jp_has_emotion = False # 等待中的日文句子是否已有动作/表情
+        self._emotion = None # 尚未归属到句子的 <em> 标签内容
+
+    def feed_line(self, line):
+        """
+        处理一行 SSE 数据
+        :return: 本行完成的句子事件 [("jp" | "cn", seq, 文本), ...]
+        """
+        self.timeline.mark("first_byte")
+
+        # 只对 SSE 负载行做 JSON 解析
+        if not line.startswith(b"data: "):
+            return []
+
+        event_data = line[6:]
+        if event_data == b"[DONE]":
+            self.done = True
+            return []
+
+        chunk = json.loads(event_data)
+        if not chunk:
+            return []
+
+        if chunk.get("usage"):
+            self.metrics.update(self.assistant._parse_usage(chunk["usage"]))
+
+        if not chunk.get("choices"):
+            return []
+
+        # 部分接口会发送 "delta": null 或 "content": null 的数据块
+        choice = chunk["choices"][0] or {}
+        content = (choice.get("delta") or {}).get("content") or ""
+        if not content:
+            return []
+
+        self.timeline.mark("first_token")
+        self.final_response += content
+
+        # 每个数据块中所有完整的句子都立即发出
+        events = []
+        for tag, sentence in self.parser.feed(content):
+            if tag == "em":
+                if self._jp_seq is not None and not self._jp_has_emotion:
+                    self._set_emotion(sentence)
+                else:
+                    self._emotion = sentence
+
+            elif tag == "jp":
+                if self._jp_seq is not None:
+                    # 上一句日文缺少中文翻译，以日文原文代替
+                    events.extend(self.finish())
+
+                # 检测到一句完整的日文文本
+                self._jp_seq = self.assistant._get_sequence_number()
+                self._jp_pending = sentence
+                self._jp_has_emotion = False
+                if self._emotion is not None:
+                    self._set_emotion(self._emotion)
+                    self._emotion = None
+                self.timeline.sentence(self._jp_seq)
+                events.append(("jp", self._jp_seq, sentence))
+
+            elif self._jp_seq is not None:
+                # 检测到一句完整的中文文本
+                events.extend(self._pair(sentence))
+
+        return events
+
+    def finish(self):
+        """结束等待中的日文句子，缺少中文翻译时以日文原文代替"""
+        if self._jp_seq is None:
+            return []
+        return self._pair(None)
+
+    def _set_emotion(self, content):
+        self._jp_has_emotion = True
+        self.assistant._set_emotion(self._jp_seq, content)
+
+    def _pair(self, cn):
+        seq = self._jp_seq
+        self.sentences.append((seq, self._jp_pending, cn))
+        self._jp_seq = None
+        return [("cn", seq, cn if cn is not None else self._jp_pending)]
@@ -0,0 +1,85 @@
+import hashlib
+import os
+import threading
+
+
+class VoiceFileStore:
+    """
+    有容量上限的语音文件目录
+
+    文件名由音频内容计算得到，相同的语音复用同一个文件；
+    超过文件数或总大小上限时删除最久未使用的文件
+    """
+
+    def __init__(self, directory, max_files=64, max_bytes=32 * 1024 * 1024, prefix="voice/"):
+        """
+        :param directory: 语音文件目录
+        :param max_files: 最多保留的文件数
+        :param max_bytes: 最多占用的字节数
+        :param prefix: 返回给游戏的播放路径前缀
+        """
+        self.directory = directory
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.prefix = prefix
+
+        self._files = None  # 文件名 -> 大小，按最近使用排序
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def write(self, data, suffix=".wav"):
+        """
+        写入一段音频(相同内容直接复用已有文件)
+        :param data: 音频数据
+        :return: 可直接播放的路径
+        """
+        name = hashlib.sha1(data).hexdigest()[:16] + suffix
+        path = os.path.join(self.directory, name)
+
+        with self._lock:
+            files = self._load_index()
+            if name in files:
+                files[name] = files.pop(name)
+                try:
+                    os.utime(path)
+                    return self.prefix + name
+                except OSError:
+                    self._total_bytes -= files.pop(name)
+
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+
+            files[name] = len(data)
+            self._total_bytes += len(data)
+            self._evict(keep=name)
+
+        return self.prefix + name
+
+    def _evict(self, keep):
+        files = self._files
+        while files and (len(files) > self.max_files or self._total_bytes > self.max_bytes):
+            oldest = next(iter(files))
+            if oldest == keep:
+                break
+            self._total_bytes -= files.pop(oldest)
+            try:
+                os.remove(os.path.join(self.directory, oldest))
+            except OSError:
+                pass
+
+    def _load_index(self):
+        """首次使用时按修改时间加载目录中已有的文件"""
+        if self._files is None:
+            os.makedirs(self.directory, exist_ok=True)
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and not entry.name.endswith(".tmp"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, entry.name, stat.st_size))
+            self._files = {}
+            for _, name, size in sorted(entries):
+                self._files[name] = size
+                self._total_bytes += size
+        return self._files